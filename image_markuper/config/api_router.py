@@ -8,8 +8,19 @@ from dicom.api.views import (
     DeleteDicomProjectApi,
     GeneratePatology,
     ListCreateDicomApi,
+    ListCreateMeshVariantApi,
     ListCreateProjectApi,
+    ListProjectMeshLevelApi,
+    ListProjectSeriesApi,
     ListUpdateDicomImageNumberApi,
+    RetrieveDicomFileApi,
+    RetrieveDicomPixelsApi,
+    RetrieveDicomRenderApi,
+    RetrieveProjectOctreeApi,
+    RetrieveProjectPixelsApi,
+    RetrieveProjectPointCloudApi,
+    RetrieveProjectStlApi,
+    RetrieveShapeCacheStatsApi,
     RetrieveUpdateDeleteCircleApi,
     RetrieveUpdateDeleteDicomApi,
     RetrieveUpdateDeleteFreeHandApi,
@@ -17,6 +28,7 @@ from dicom.api.views import (
     RetrieveUpdateDeleteProjectApi,
     RetrieveUpdateDeleteRoiApi,
     RetrieveUpdateDeleteRulerApi,
+    RetrieveUploadJobApi,
     SmartFileUploadApi,
 )
 from django.urls import include, path
@@ -40,11 +52,31 @@ urlpatterns = [
             [
                 path("", ListCreateDicomApi.as_view(), name="dicom_list_create"),
                 path("upload", SmartFileUploadApi.as_view(), name="upload_dicom_api"),
+                path(
+                    "upload/<str:slug>",
+                    RetrieveUploadJobApi.as_view(),
+                    name="get_upload_job",
+                ),
                 path(
                     "<str:slug>",
                     RetrieveUpdateDeleteDicomApi.as_view(),
                     name="get_update_delete_dicom",
                 ),
+                path(
+                    "<str:slug>/render",
+                    RetrieveDicomRenderApi.as_view(),
+                    name="render_dicom",
+                ),
+                path(
+                    "<str:slug>/file",
+                    RetrieveDicomFileApi.as_view(),
+                    name="get_dicom_file",
+                ),
+                path(
+                    "<str:slug>/pixels",
+                    RetrieveDicomPixelsApi.as_view(),
+                    name="get_dicom_pixels",
+                ),
                 path(
                     "<str:slug>/roi",
                     CreateRoiApi.as_view(),
@@ -77,6 +109,11 @@ urlpatterns = [
         "shapes/",
         include(
             [
+                path(
+                    "cache",
+                    RetrieveShapeCacheStatsApi.as_view(),
+                    name="get_shape_cache_stats",
+                ),
                 path(
                     "roi/<int:id>",
                     RetrieveUpdateDeleteRoiApi.as_view(),
@@ -115,6 +152,41 @@ urlpatterns = [
                     AddDicomProjectApi.as_view(),
                     name="add_dicom_api",
                 ),
+                path(
+                    "<str:slug>/pixels",
+                    RetrieveProjectPixelsApi.as_view(),
+                    name="get_project_pixels",
+                ),
+                path(
+                    "<str:slug>/stl",
+                    RetrieveProjectStlApi.as_view(),
+                    name="get_project_stl",
+                ),
+                path(
+                    "<str:slug>/series",
+                    ListProjectSeriesApi.as_view(),
+                    name="list_project_series",
+                ),
+                path(
+                    "<str:slug>/lods",
+                    ListProjectMeshLevelApi.as_view(),
+                    name="list_project_lods",
+                ),
+                path(
+                    "<str:slug>/points",
+                    RetrieveProjectPointCloudApi.as_view(),
+                    name="get_project_point_cloud",
+                ),
+                path(
+                    "<str:slug>/octree",
+                    RetrieveProjectOctreeApi.as_view(),
+                    name="get_project_octree",
+                ),
+                path(
+                    "<str:slug>/mesh",
+                    ListCreateMeshVariantApi.as_view(),
+                    name="list_create_mesh_variant",
+                ),
                 path(
                     "<str:slug>/<str:dicom_slug>",
                     DeleteDicomProjectApi.as_view(),
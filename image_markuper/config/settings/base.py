@@ -270,6 +270,9 @@ CELERY_TASK_TIME_LIMIT = 5 * 60
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#task-soft-time-limit
 # TODO: set to whatever value is adequate in your circumstances
 CELERY_TASK_SOFT_TIME_LIMIT = 60
+# https://docs.celeryq.dev/en/stable/userguide/configuration.html#task-routes
+# previews are many and cheap, kept apart so they never hold up uploads
+CELERY_TASK_ROUTES = {"dicom.tasks.process_previews": {"queue": "previews"}}
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#beat-scheduler
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 
@@ -300,3 +303,55 @@ SPECTACULAR_SETTINGS = {
 }
 
 SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
+
+# DICOM
+# ------------------------------------------------------------------------------
+# per-project memory-mapped volumes, rebuilt after files are added or removed
+DICOM_VOLUME_CACHE_ROOT = env(
+    "DICOM_VOLUME_CACHE_ROOT", default=str(ROOT_DIR / "volumes")
+)
+# slice decoding processes for volume builds, 1 decodes in the calling process
+DICOM_DECODE_WORKERS = env.int("DICOM_DECODE_WORKERS", default=1)
+DICOM_DECODE_CHUNK_SIZE = env.int("DICOM_DECODE_CHUNK_SIZE", default=16)
+# mesh files written next to Project.stl, any of "stl", "ply" and "glb"
+DICOM_MESH_FORMATS = env.list("DICOM_MESH_FORMATS", default=["stl"])
+# marching cubes step of each coarser level of detail, LOD1..LODn
+DICOM_MESH_LOD_STEPS = env.list("DICOM_MESH_LOD_STEPS", cast=int, default=[2, 4, 8])
+# above this much memory marching cubes walks the volume in slabs
+DICOM_MESH_MEMORY_LIMIT = env.int("DICOM_MESH_MEMORY_LIMIT", default=1024**3)
+# disk budget of on-demand mesh variants, least recently used are evicted
+DICOM_MESH_CACHE_BYTES = env.int("DICOM_MESH_CACHE_BYTES", default=5 * 1024**3)
+# seconds a variant may stay pending before its build counts as lost
+DICOM_MESH_VARIANT_TIMEOUT = env.int(
+    "DICOM_MESH_VARIANT_TIMEOUT", default=2 * CELERY_TASK_TIME_LIMIT
+)
+# octree over stored pixel values above this, for region point queries
+DICOM_OCTREE_THRESHOLD = env.float("DICOM_OCTREE_THRESHOLD", default=240)
+# memory an octree build holds at once, in bytes, whatever the voxel count
+DICOM_OCTREE_MEMORY_LIMIT = env.int(
+    "DICOM_OCTREE_MEMORY_LIMIT", default=256 * 1024**2
+)
+# Morton ranges a box query is split into before border cells are kept whole
+DICOM_OCTREE_MAX_RANGES = env.int("DICOM_OCTREE_MAX_RANGES", default=512)
+# hard cap on the points one octree query returns
+DICOM_OCTREE_QUERY_MAX_POINTS = env.int("DICOM_OCTREE_QUERY_MAX_POINTS", default=262144)
+# quiet period after the last change before a project is rebuilt, in seconds
+DICOM_REBUILD_DELAY = env.int("DICOM_REBUILD_DELAY", default=5)
+# rebuild versions and locks live here, shared by web and worker processes
+DICOM_REBUILD_REDIS_URL = env("REDIS_URL", default=CELERY_BROKER_URL)
+# windowed slice renders, keyed by content hash and render parameters
+DICOM_RENDER_CACHE_ROOT = env(
+    "DICOM_RENDER_CACHE_ROOT", default=str(ROOT_DIR / "renders")
+)
+# largest side a slice is rendered at
+DICOM_RENDER_MAX_SIZE = env.int("DICOM_RENDER_MAX_SIZE", default=2048)
+# decoded int16 slices and their compressed frames, keyed by content hash
+DICOM_PIXEL_CACHE_ROOT = env("DICOM_PIXEL_CACHE_ROOT", default=str(ROOT_DIR / "pixels"))
+# preview sides rendered at ingest, next to the full size one
+DICOM_PREVIEW_SIZES = env.list("DICOM_PREVIEW_SIZES", cast=int, default=[64, 256])
+# dicoms rendered per preview task
+DICOM_PREVIEW_BATCH = env.int("DICOM_PREVIEW_BATCH", default=50)
+# serialized shapes and layers of a dicom stay cached this long, in seconds
+DICOM_SHAPES_CACHE_TIMEOUT = env.int("DICOM_SHAPES_CACHE_TIMEOUT", default=24 * 60 * 60)
+# slices one pixel range request may ask for
+DICOM_PIXEL_MAX_SLICES = env.int("DICOM_PIXEL_MAX_SLICES", default=64)
@@ -1,7 +1,7 @@
 import pytest
-
-from image_markuper.users.models import User
-from image_markuper.users.tests.factories import UserFactory
+from celery.app.task import Task
+from users.models import User
+from users.tests.factories import UserFactory
 
 
 @pytest.fixture(autouse=True)
@@ -9,6 +9,25 @@ def media_storage(settings, tmpdir):
     settings.MEDIA_ROOT = tmpdir.strpath
 
 
+@pytest.fixture(autouse=True)
+def dicom_caches(settings, tmp_path):
+    settings.DICOM_VOLUME_CACHE_ROOT = str(tmp_path / "volumes")
+    settings.DICOM_RENDER_CACHE_ROOT = str(tmp_path / "renders")
+    settings.DICOM_PIXEL_CACHE_ROOT = str(tmp_path / "pixels")
+
+
+@pytest.fixture(autouse=True)
+def celery_tasks(monkeypatch) -> list[tuple[str, tuple, dict]]:
+    """Tasks queued during a test, recorded instead of sent to the broker."""
+    queued = []
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        queued.append((self.name, tuple(args or ()), kwargs or {}))
+
+    monkeypatch.setattr(Task, "apply_async", apply_async)
+    return queued
+
+
 @pytest.fixture
 def user(db) -> User:
     return UserFactory()
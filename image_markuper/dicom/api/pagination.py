@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ProjectCursorPagination(CursorPagination):
+    """Keyset pages, newest first, as fast deep in the list as on top."""
+
+    ordering = "-created"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+
+class DicomCursorPagination(ProjectCursorPagination):
+    ordering = "-uploaded"
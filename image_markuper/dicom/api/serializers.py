@@ -5,11 +5,20 @@ from dicom.models import (
     Dicom,
     FreeHand,
     Layer,
+    MeshLevel,
+    MeshVariant,
     Project,
     Roi,
     Ruler,
+    UploadJob,
 )
-from dicom.services import create_coordinate
+from dicom.services import create_coordinate, replace_dicom_file
+from dicom.services.pixels import PIXEL_ENCODINGS
+from dicom.services.previews import preview_url, preview_urls
+from dicom.services.render import RENDER_FORMATS, WINDOW_PRESETS
+from dicom.services.shape_cache import cached_shapes
+from dicom.services.shapes import SHAPE_MODELS
+from django.conf import settings
 from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 from rest_framework.generics import get_object_or_404
@@ -25,15 +34,25 @@ class ListProjectSerializer(serializers.ModelSerializer):
     url = serializers.HyperlinkedIdentityField(
         view_name="get_update_delete_project", lookup_field="slug"
     )
+    thumbnail = serializers.SerializerMethodField()
 
     class Meta:
         model = Project
-        fields = ["name", "pathology_type", "slug", "url", "created"]
+        fields = ["name", "pathology_type", "slug", "url", "thumbnail", "created"]
         extra_kwargs = {
             "slug": {"read_only": True},
             "created": {"read_only": True},
         }
 
+    @extend_schema_field(serializers.URLField(allow_null=True))
+    def get_thumbnail(self, obj):
+        if obj.thumbnail is None:
+            return None
+        size = max(settings.DICOM_PREVIEW_SIZES, default=None)
+        return self.context["request"].build_absolute_uri(
+            preview_url(obj.thumbnail, size)
+        )
+
     def create(self, validated_data):
         return Project.objects.create(
             user=self.context["request"].user,
@@ -42,26 +61,203 @@ class ListProjectSerializer(serializers.ModelSerializer):
         )
 
 
+class StaffListProjectSerializer(ListProjectSerializer):
+    class Meta(ListProjectSerializer.Meta):
+        fields = [*ListProjectSerializer.Meta.fields, "user_username"]
+
+
+DICOM_HEADER_FIELDS = [
+    "study_instance_uid",
+    "series_instance_uid",
+    "instance_number",
+    "slice_location",
+    "image_position",
+    "pixel_spacing",
+    "rows",
+    "columns",
+    "bits_allocated",
+    "transfer_syntax",
+]
+
+
+class DateRangeFilterSerializer(serializers.Serializer):
+    after = serializers.DateTimeField(required=False)
+    before = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        if "after" in attrs and "before" in attrs and attrs["after"] > attrs["before"]:
+            raise serializers.ValidationError("after must not be later than before")
+        return attrs
+
+
+class ProjectFilterSerializer(DateRangeFilterSerializer):
+    """Projects created in [after, before], by pathology type and owner."""
+
+    pathology_type = serializers.ChoiceField(
+        choices=Project.PathologyType.choices, required=False
+    )
+    user = serializers.CharField(max_length=150, required=False)
+
+
+class DicomFilterSerializer(DateRangeFilterSerializer):
+    """Dicoms uploaded in [after, before], by project, study and series."""
+
+    project = serializers.SlugField(required=False)
+    study = serializers.CharField(max_length=64, required=False)
+    series = serializers.CharField(max_length=64, required=False)
+
+
+class SeriesSerializer(serializers.Serializer):
+    study_instance_uid = serializers.CharField()
+    series_instance_uid = serializers.CharField()
+    slices = serializers.IntegerField()
+    rows = serializers.IntegerField(allow_null=True)
+    columns = serializers.IntegerField(allow_null=True)
+    first_position = serializers.FloatField(allow_null=True)
+    last_position = serializers.FloatField(allow_null=True)
+
+
 class ListDicomSerializer(serializers.ModelSerializer):
     url = serializers.HyperlinkedIdentityField(
         view_name="get_update_delete_dicom", lookup_field="slug"
     )
     file = serializers.FileField()
+    previews = serializers.SerializerMethodField()
 
     class Meta:
         model = Dicom
-        fields = ["file", "uploaded", "url"]
+        fields = ["file", "uploaded", "url", "previews", *DICOM_HEADER_FIELDS]
+        read_only_fields = DICOM_HEADER_FIELDS
+
+    @extend_schema_field(serializers.DictField(child=serializers.URLField()))
+    def get_previews(self, obj):
+        request = self.context["request"]
+        return {
+            size: request.build_absolute_uri(url)
+            for size, url in preview_urls(obj).items()
+        }
 
     def create(self, validated_data):
         return Dicom.objects.create(**validated_data, user=self.context["request"].user)
 
 
+class MeshLevelSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MeshLevel
+        fields = ["level", "file", "triangles", "size"]
+
+
+class MeshVariantRoiSerializer(serializers.Serializer):
+    x = serializers.ListField(
+        child=serializers.IntegerField(min_value=0), min_length=2, max_length=2
+    )
+    y = serializers.ListField(
+        child=serializers.IntegerField(min_value=0), min_length=2, max_length=2
+    )
+    z = serializers.ListField(
+        child=serializers.IntegerField(min_value=0), min_length=2, max_length=2
+    )
+
+    def validate(self, attrs):
+        for axis in "xyz":
+            if attrs[axis][0] >= attrs[axis][1]:
+                raise serializers.ValidationError(f"empty {axis} range")
+        return attrs
+
+
+class MeshVariantRequestSerializer(serializers.Serializer):
+    threshold = serializers.FloatField()
+    step_size = serializers.IntegerField(min_value=1, max_value=16, default=1)
+    roi = MeshVariantRoiSerializer(required=False, allow_null=True, default=None)
+
+
+class MeshVariantSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MeshVariant
+        fields = [
+            "threshold",
+            "step_size",
+            "roi",
+            "status",
+            "file",
+            "triangles",
+            "size",
+            "created",
+        ]
+
+
+class PointCloudQuerySerializer(serializers.Serializer):
+    stride = serializers.IntegerField(min_value=1, max_value=64, default=10)
+    threshold = serializers.FloatField(default=240)
+    min = serializers.FloatField(required=False)
+    max = serializers.FloatField(required=False)
+    # not `format`, DRF reserves it for renderer negotiation
+    encoding = serializers.ChoiceField(choices=["bin", "ply"], default="bin")
+
+
+class RenderQuerySerializer(serializers.Serializer):
+    """Window in modality units (HU for CT), a preset, or the file's default."""
+
+    center = serializers.IntegerField(required=False)
+    width = serializers.IntegerField(min_value=1, required=False)
+    preset = serializers.ChoiceField(choices=list(WINDOW_PRESETS), required=False)
+    size = serializers.IntegerField(
+        min_value=16, max_value=settings.DICOM_RENDER_MAX_SIZE, required=False
+    )
+    encoding = serializers.ChoiceField(choices=list(RENDER_FORMATS), default="png")
+
+    def validate(self, attrs):
+        if ("center" in attrs) != ("width" in attrs):
+            raise serializers.ValidationError("center and width go together")
+        if "preset" in attrs and "center" in attrs:
+            raise serializers.ValidationError("either a preset or a window")
+        return attrs
+
+
+class PixelQuerySerializer(serializers.Serializer):
+    encoding = serializers.ChoiceField(choices=list(PIXEL_ENCODINGS), default="zstd")
+
+
+class PixelRangeQuerySerializer(PixelQuerySerializer):
+    """Slices [start, stop) of the project in stack order."""
+
+    start = serializers.IntegerField(min_value=0, default=0)
+    stop = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, attrs):
+        stop = attrs.setdefault(
+            "stop", attrs["start"] + settings.DICOM_PIXEL_MAX_SLICES
+        )
+        if stop <= attrs["start"]:
+            raise serializers.ValidationError("stop must be above start")
+        if stop - attrs["start"] > settings.DICOM_PIXEL_MAX_SLICES:
+            raise serializers.ValidationError(
+                f"at most {settings.DICOM_PIXEL_MAX_SLICES} slices per request"
+            )
+        return attrs
+
+
+class OctreeQuerySerializer(serializers.Serializer):
+    """Voxel box [x0, x1) x [y0, y1) x [z0, z1), the whole volume by default."""
+
+    x0 = serializers.IntegerField(min_value=0, default=0)
+    x1 = serializers.IntegerField(min_value=1, required=False)
+    y0 = serializers.IntegerField(min_value=0, default=0)
+    y1 = serializers.IntegerField(min_value=1, required=False)
+    z0 = serializers.IntegerField(min_value=0, default=0)
+    z1 = serializers.IntegerField(min_value=1, required=False)
+    depth = serializers.IntegerField(min_value=0, max_value=21, default=5)
+    limit = serializers.IntegerField(min_value=1, required=False)
+    encoding = serializers.ChoiceField(choices=["bin", "ply"], default="bin")
+
+
 class ProjectSerializer(serializers.ModelSerializer):
-    files = ListDicomSerializer(many=True)
+    files = ListDicomSerializer(many=True, source="slices")
+    lods = MeshLevelSerializer(many=True, read_only=True)
 
     class Meta:
         model = Project
-        fields = ["files", "slug", "created", "stl"]
+        fields = ["files", "slug", "created", "stl", "ply", "glb", "lods"]
 
 
 class BaseShapeSerializer(serializers.Serializer):
@@ -116,18 +312,17 @@ class BaseShapeLayerSerializer(serializers.Serializer):
     radius = serializers.FloatField(required=False)
     coordinates = CoordinateSerializer(many=True)
 
-    def validate_layer(self, val):
-        if val:
-            return get_object_or_404(Layer, slug=val).slug
-        return (
-            get_object_or_404(
-                Dicom,
-                slug=self.context["request"].parser_context["kwargs"]["dicom_slug"],
-            )
-            .layers.filter(parent__isnull=True)
-            .first()
-            .slug
-        )
+    def validate(self, attrs):
+        # layer slugs are resolved for the whole list at once by replace_shapes
+        model = SHAPE_MODELS[attrs["type"]]
+        if model is Circle and attrs.get("radius") is None:
+            raise serializers.ValidationError({"radius": "required for a circle"})
+        count = len(attrs["coordinates"])
+        if model.max_coordinates and count > model.max_coordinates:
+            raise serializers.ValidationError({"coordinates": "too many points"})
+        if model.min_coordinates and count < model.min_coordinates:
+            raise serializers.ValidationError({"coordinates": "too few points"})
+        return attrs
 
 
 class LayerChildSerializer(serializers.ModelSerializer):
@@ -168,6 +363,15 @@ class LayerSerializer(serializers.ModelSerializer):
             parent=validated_data["parent"],
         )
 
+    def update(self, instance, validated_data):
+        parent = validated_data.pop("parent", None)
+        if parent is not None and parent.pk != instance.parent_id:
+            try:
+                instance.move_to(parent)
+            except ValueError as e:
+                raise serializers.ValidationError({"parent": str(e)})
+        return super().update(instance, validated_data)
+
 
 class DicomSerializer(serializers.ModelSerializer):
     file = serializers.FileField()
@@ -176,17 +380,54 @@ class DicomSerializer(serializers.ModelSerializer):
 
     @extend_schema_field(field=BaseShapeSerializer(many=True))
     def get_dicom_shapes(self, obj):
-        return [x.serialize_self() for x in obj.shapes.all()]
+        return self.get_annotations(obj)["shapes"]
 
     @extend_schema_field(field=LayerSerializer(many=True))
     def get_dicom_layers(self, obj):
-        return obj.get_layers()
+        return self.get_annotations(obj)["layers"]
+
+    def get_annotations(self, obj) -> dict:
+        """
+        Shapes and layers, read once per serialization. With `cached` in the
+        context they come through the per-dicom cache, which only reads that
+        see committed data may fill.
+        """
+        if getattr(obj, "_annotations", None) is None:
+
+            def build():
+                return {
+                    "shapes": [x.serialize_self() for x in obj.get_shapes()],
+                    "layers": obj.get_layers(),
+                }
+
+            if self.context.get("cached"):
+                obj._annotations = cached_shapes(obj.pk, build)
+            else:
+                obj._annotations = build()
+        return obj._annotations
+
+    def update(self, instance, validated_data):
+        content = validated_data.pop("file", None)
+        instance = super().update(instance, validated_data)
+        if content is not None:
+            try:
+                replace_dicom_file(instance, content)
+            except ValueError as e:
+                raise serializers.ValidationError({"file": str(e)})
+        return instance
 
     class Meta:
         model = Dicom
         fields = ["file", "uploaded", "shapes", "layers"]
 
 
+class ShapeCacheStatsSerializer(serializers.Serializer):
+    hits = serializers.IntegerField()
+    misses = serializers.IntegerField()
+    invalidations = serializers.IntegerField()
+    hit_rate = serializers.FloatField(allow_null=True)
+
+
 class RoiSerializer(BaseShapeSerializer, serializers.ModelSerializer):
     coordinates = CoordinateSerializer(many=True)
     layer = serializers.SlugField(max_length=8, required=False, allow_blank=True)
@@ -268,6 +509,40 @@ class SmartFileUploadSerializer(serializers.Serializer):
     file = serializers.FileField()
 
 
+class UploadJobSerializer(serializers.ModelSerializer):
+    url = serializers.HyperlinkedIdentityField(
+        view_name="get_upload_job", lookup_field="slug"
+    )
+    project = serializers.SlugRelatedField(slug_field="slug", read_only=True)
+    project_url = serializers.HyperlinkedRelatedField(
+        source="project",
+        view_name="get_update_delete_project",
+        lookup_field="slug",
+        read_only=True,
+    )
+    # deprecated, the name of uploads_pending before it was renamed
+    pending = serializers.IntegerField(source="uploads_pending", read_only=True)
+
+    class Meta:
+        model = UploadJob
+        fields = [
+            "slug",
+            "url",
+            "status",
+            "accepted",
+            "rejected",
+            "duplicates",
+            "uploads_pending",
+            "pending",
+            "bytes",
+            "error",
+            "project",
+            "project_url",
+            "created",
+            "finished",
+        ]
+
+
 class PatologyGenerateSerializer(serializers.Serializer):
     project_slug = serializers.CharField()
     points = serializers.ListField(child=CoordinateSerializer())
@@ -1,36 +1,93 @@
-from drf_spectacular.utils import extend_schema
+from django.conf import settings
+from django.db.models import Count, Max, Min
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from drf_spectacular.utils import OpenApiTypes, extend_schema
 from rest_framework import generics, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import GenericAPIView, get_object_or_404
 from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
-
-from ..models import Circle, Dicom, FreeHand, Layer, Project, Roi, Ruler
-from ..services import process_files
+from utils.files import serve_file
+
+from ..models import Dicom, Layer, Project, UploadJob
+from ..services import (
+    content_name,
+    create_upload_job,
+    delete_shapes,
+    generate_3d_point_cloud,
+    invalidate_shapes,
+    load_volume,
+    pixel_payload,
+    point_cloud_stream,
+    query_octree,
+    render_key,
+    render_slice,
+    replace_shapes,
+    request_mesh_variant,
+    schedule_volume_build,
+    shape_cache_stats,
+)
+from ..services.render import RENDER_FORMATS, WINDOW_PRESETS
+from .pagination import DicomCursorPagination, ProjectCursorPagination
 from .serializers import (
     BaseShapeLayerSerializer,
     BaseShapeSerializer,
     CircleSerializer,
+    DicomFilterSerializer,
     DicomSerializer,
     FreeHandSerializer,
     LayerSerializer,
     ListDicomSerializer,
     ListProjectSerializer,
+    MeshLevelSerializer,
+    MeshVariantRequestSerializer,
+    MeshVariantSerializer,
+    OctreeQuerySerializer,
     PatologyGenerateSerializer,
+    PixelQuerySerializer,
+    PixelRangeQuerySerializer,
+    PointCloudQuerySerializer,
+    ProjectFilterSerializer,
     ProjectSerializer,
+    RenderQuerySerializer,
     RoiSerializer,
     RulerSerializer,
+    SeriesSerializer,
+    ShapeCacheStatsSerializer,
     SmartFileUploadSerializer,
-    create_coordinate,
+    StaffListProjectSerializer,
+    UploadJobSerializer,
 )
 
 
 class ListCreateDicomApi(generics.ListCreateAPIView):
     serializer_class = ListDicomSerializer
     parser_classes = [MultiPartParser, FormParser]
+    pagination_class = DicomCursorPagination
 
     def get_queryset(self):
-        return Dicom.objects.all()
+        serializer = DicomFilterSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        queryset = Dicom.objects.all()
+        if "project" in query:
+            queryset = queryset.filter(project__slug=query["project"])
+        if "study" in query:
+            queryset = queryset.filter(study_instance_uid=query["study"])
+        if "series" in query:
+            queryset = queryset.filter(series_instance_uid=query["series"])
+        if "after" in query:
+            queryset = queryset.filter(uploaded__gte=query["after"])
+        if "before" in query:
+            queryset = queryset.filter(uploaded__lte=query["before"])
+        return queryset
+
+    @extend_schema(parameters=[DicomFilterSerializer])
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
 
 
 class RetrieveUpdateDeleteDicomApi(generics.RetrieveUpdateDestroyAPIView):
@@ -43,19 +100,123 @@ class RetrieveUpdateDeleteDicomApi(generics.RetrieveUpdateDestroyAPIView):
     lookup_field = "slug"
 
 
-class CreateRoiApi(generics.CreateAPIView):
+PIXELS_DESCRIPTION = (
+    "Little-endian uint32 header length, a JSON header with shape, spacing and "
+    "per-slice rescale and frame sizes, then one frame of little-endian int16 "
+    "pixels per slice in the requested encoding"
+)
+
+
+def pixels_response(dicoms: list[Dicom], encoding: str) -> StreamingHttpResponse:
+    try:
+        length, chunks = pixel_payload(dicoms, encoding)
+    except ValueError as e:
+        raise ValidationError(str(e))
+    response = StreamingHttpResponse(chunks, content_type="application/octet-stream")
+    response["Content-Length"] = length
+    response["X-Slice-Count"] = len(dicoms)
+    return response
+
+
+class RetrieveDicomRenderApi(GenericAPIView):
+    serializer_class = RenderQuerySerializer
+
+    @extend_schema(
+        parameters=[RenderQuerySerializer],
+        description="8-bit rendering of the slice through a window, validated by "
+        "its ETag. Presets and the default window are cached at full size and "
+        "preview sizes, other windows and sizes are rendered on every request",
+        responses={
+            (200, "image/png"): OpenApiTypes.BINARY,
+            (200, "image/webp"): OpenApiTypes.BINARY,
+            304: None,
+        },
+        operation_id="render_dicom",
+    )
+    def get(self, request, slug):
+        dicom = get_object_or_404(Dicom, slug=slug)
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        window = None
+        if "preset" in query:
+            window = WINDOW_PRESETS[query["preset"]]
+        elif "center" in query:
+            window = (query["center"], query["width"])
+        size, encoding = query.get("size"), query["encoding"]
+
+        etag = quote_etag(render_key(dicom, window, size, encoding))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(
+                render_slice(dicom, window, size, encoding),
+                content_type=RENDER_FORMATS[encoding][1],
+            )
+        response["ETag"] = etag
+        # a slice may be replaced under its slug, so revalidate every time
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class RetrieveDicomPixelsApi(GenericAPIView):
+    serializer_class = PixelQuerySerializer
+
+    @extend_schema(
+        parameters=[PixelQuerySerializer],
+        description=PIXELS_DESCRIPTION,
+        responses={(200, "application/octet-stream"): OpenApiTypes.BINARY},
+        operation_id="get_dicom_pixels",
+    )
+    def get(self, request, slug):
+        dicom = get_object_or_404(Dicom, slug=slug)
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return pixels_response([dicom], serializer.validated_data["encoding"])
+
+
+class RetrieveDicomFileApi(GenericAPIView):
+    @extend_schema(
+        description="The DICOM file, with ETag, conditional GET and byte ranges",
+        responses={
+            (200, "application/dicom"): OpenApiTypes.BINARY,
+            (206, "application/dicom"): OpenApiTypes.BINARY,
+            304: None,
+            416: None,
+        },
+        operation_id="get_dicom_file",
+    )
+    def get(self, request, slug):
+        dicom = get_object_or_404(Dicom, slug=slug)
+        # a content addressed name can never point at other bytes
+        addressed = bool(dicom.sha256) and dicom.file.name == content_name(dicom.sha256)
+        return serve_file(
+            request,
+            dicom.file.path,
+            "application/dicom",
+            etag=dicom.sha256 if addressed else None,
+            immutable=addressed,
+        )
+
+
+class CreateShapeApi(generics.CreateAPIView):
+    def perform_create(self, serializer):
+        shape = serializer.save()
+        invalidate_shapes(shape.layer_fk.dicom_id)
+
+
+class CreateRoiApi(CreateShapeApi):
     serializer_class = RoiSerializer
 
 
-class CreateFreeHandApi(generics.CreateAPIView):
+class CreateFreeHandApi(CreateShapeApi):
     serializer_class = FreeHandSerializer
 
 
-class CreateCircleApi(generics.CreateAPIView):
+class CreateCircleApi(CreateShapeApi):
     serializer_class = CircleSerializer
 
 
-class CreateRulerApi(generics.CreateAPIView):
+class CreateRulerApi(CreateShapeApi):
     serializer_class = RulerSerializer
 
 
@@ -74,6 +235,18 @@ class RetrieveUpdateDeleteBaseShape(generics.RetrieveUpdateDestroyAPIView):
     def patch(self, request, *args, **kwargs):
         return self.partial_update(request, *args, **kwargs)
 
+    def perform_update(self, serializer):
+        dicom_id = serializer.instance.layer_fk.dicom_id
+        shape = serializer.save()
+        # the shape may have moved to a layer of another dicom
+        for pk in {dicom_id, shape.layer_fk.dicom_id}:
+            invalidate_shapes(pk)
+
+    def perform_destroy(self, instance):
+        dicom_id = instance.layer_fk.dicom_id
+        instance.delete()
+        invalidate_shapes(dicom_id)
+
 
 class RetrieveUpdateDeleteRoiApi(RetrieveUpdateDeleteBaseShape):
     serializer_class = RoiSerializer
@@ -95,17 +268,15 @@ class SmartFileUploadApi(GenericAPIView):
     parser_classes = [MultiPartParser, FormParser]
     serializer_class = SmartFileUploadSerializer
 
-    @extend_schema(responses={201: ListDicomSerializer(many=True)})
+    @extend_schema(responses={202: UploadJobSerializer})
     def post(self, request):
         if "file" not in request.data:
             raise ValidationError("no files")
-        project = process_files(
-            request.FILES.getlist("file"),
-            request.user,
-        )
+        job = create_upload_job(request.FILES.getlist("file"), request.user)
         return Response(
-            ProjectSerializer(project, context={"request": request}).data,
-            status=status.HTTP_201_CREATED,
+            UploadJobSerializer(job, context={"request": request}).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": job.get_absolute_url()},
         )
 
 
@@ -115,23 +286,28 @@ class AddDicomProjectApi(GenericAPIView):
 
     @extend_schema(
         operation_id="add_dicom_to_project",
-        responses={201: ListDicomSerializer(many=True)},
+        responses={202: UploadJobSerializer},
     )
     def post(self, request, slug):
         if "file" not in request.data:
             raise ValidationError("no files")
-        get_object_or_404(Project, slug=slug)
-        project = process_files(
-            request.FILES.getlist("file"),
-            request.user,
-            slug,
-        )
+        project = get_object_or_404(Project, slug=slug)
+        job = create_upload_job(request.FILES.getlist("file"), request.user, project)
         return Response(
-            ProjectSerializer(project, context={"request": request}).data,
-            status=status.HTTP_201_CREATED,
+            UploadJobSerializer(job, context={"request": request}).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": job.get_absolute_url()},
         )
 
 
+class RetrieveUploadJobApi(generics.RetrieveAPIView):
+    serializer_class = UploadJobSerializer
+    lookup_field = "slug"
+
+    def get_queryset(self):
+        return UploadJob.objects.filter(user=self.request.user)
+
+
 class DeleteDicomProjectApi(GenericAPIView):
     serializer_class = SmartFileUploadSerializer
 
@@ -161,7 +337,8 @@ class ListUpdateDicomImageNumberApi(GenericAPIView):
     def get(self, request, dicom_slug):
         return Response(
             DicomSerializer(
-                get_object_or_404(Dicom, slug=dicom_slug), context={"request": request}
+                get_object_or_404(Dicom, slug=dicom_slug),
+                context={"request": request, "cached": True},
             ).data,
             status=status.HTTP_200_OK,
         )
@@ -173,22 +350,11 @@ class ListUpdateDicomImageNumberApi(GenericAPIView):
     )
     def put(self, request, dicom_slug):
         dicom = get_object_or_404(Dicom, slug=dicom_slug)
-        dicom.delete_shapes()
         serializer = BaseShapeLayerSerializer(
             data=request.data, many=True, context={"request": request}
         )
         serializer.is_valid(raise_exception=True)
-        for shape in serializer.data:
-            layer = Layer.objects.get(slug=shape["layer"])
-            if shape["type"] == "circle":
-                obj = Circle.objects.create(layer_fk=layer, radius=shape["radius"])
-            elif shape["type"] == "roi":
-                obj = Roi.objects.create(layer_fk=layer)
-            elif shape["type"] == "free_hand":
-                obj = FreeHand.objects.create(layer_fk=layer)
-            else:
-                obj = Ruler.objects.create(layer_fk=layer)
-            create_coordinate(shape["coordinates"], obj)
+        replace_shapes(dicom, serializer.validated_data)
         return Response(
             DicomSerializer(dicom, context={"request": request}).data,
             status=status.HTTP_200_OK,
@@ -201,22 +367,50 @@ class ListUpdateDicomImageNumberApi(GenericAPIView):
     )
     def delete(self, request, dicom_slug):
         dicom = get_object_or_404(Dicom, slug=dicom_slug)
-        dicom.shapes.delete()
+        delete_shapes(dicom)
+        invalidate_shapes(dicom.pk)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class RetrieveShapeCacheStatsApi(GenericAPIView):
+    serializer_class = ShapeCacheStatsSerializer
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(operation_id="get_shape_cache_stats")
+    def get(self, request):
+        return Response(self.get_serializer(shape_cache_stats()).data)
+
+
 class ListCreateProjectApi(generics.ListCreateAPIView):
+    pagination_class = ProjectCursorPagination
+
     def get_serializer_class(self):
         if self.request.user.is_staff:
-            s = ListProjectSerializer
-            s.Meta.fields.append("user_username")
-            return s
+            return StaffListProjectSerializer
         return ListProjectSerializer
 
     def get_queryset(self):
+        queryset = Project.objects.select_related("thumbnail")
+        serializer = ProjectFilterSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
         if self.request.user.is_staff:
-            return Project.objects.all()
-        return Project.objects.filter(user=self.request.user)
+            queryset = queryset.select_related("user")
+            if "user" in query:
+                queryset = queryset.filter(user__username=query["user"])
+        else:
+            queryset = queryset.filter(user=self.request.user)
+        if "pathology_type" in query:
+            queryset = queryset.filter(pathology_type=query["pathology_type"])
+        if "after" in query:
+            queryset = queryset.filter(created__gte=query["after"])
+        if "before" in query:
+            queryset = queryset.filter(created__lte=query["before"])
+        return queryset
+
+    @extend_schema(parameters=[ProjectFilterSerializer])
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
 
     @extend_schema(
         description="""(0, 'Без патологий'),
@@ -243,6 +437,204 @@ class RetrieveUpdateDeleteProjectApi(generics.RetrieveUpdateDestroyAPIView):
     lookup_field = "slug"
 
 
+class RetrieveProjectPixelsApi(GenericAPIView):
+    serializer_class = PixelRangeQuerySerializer
+
+    @extend_schema(
+        parameters=[PixelRangeQuerySerializer],
+        description=PIXELS_DESCRIPTION,
+        responses={(200, "application/octet-stream"): OpenApiTypes.BINARY},
+        operation_id="get_project_pixels",
+    )
+    def get(self, request, slug):
+        project = get_object_or_404(Project, slug=slug)
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        dicoms = list(project.slices[query["start"] : query["stop"]])  # noqa
+        if not dicoms:
+            raise ValidationError("no slices in this range")
+        return pixels_response(dicoms, query["encoding"])
+
+
+class RetrieveProjectStlApi(GenericAPIView):
+    @extend_schema(
+        description="The project's full resolution STL mesh, with ETag, "
+        "conditional GET and byte ranges",
+        responses={
+            (200, "model/stl"): OpenApiTypes.BINARY,
+            (206, "model/stl"): OpenApiTypes.BINARY,
+            304: None,
+            416: None,
+        },
+        operation_id="get_project_stl",
+    )
+    def get(self, request, slug):
+        project = get_object_or_404(Project, slug=slug)
+        if not project.stl:
+            raise Http404("the mesh of this project is not built yet")
+        return serve_file(
+            request, project.stl.path, "model/stl", etag=project.stl_sha256 or None
+        )
+
+
+class ListProjectSeriesApi(generics.ListAPIView):
+    """The project's slices grouped by series, from the header index alone."""
+
+    serializer_class = SeriesSerializer
+
+    def get_queryset(self):
+        project = get_object_or_404(Project, slug=self.kwargs["slug"])
+        return (
+            project.files.values("study_instance_uid", "series_instance_uid")
+            .annotate(
+                slices=Count("pk"),
+                rows=Max("rows"),
+                columns=Max("columns"),
+                first_position=Min("slice_position"),
+                last_position=Max("slice_position"),
+            )
+            .order_by("study_instance_uid", "series_instance_uid")
+        )
+
+
+class ListProjectMeshLevelApi(generics.ListAPIView):
+    serializer_class = MeshLevelSerializer
+
+    def get_queryset(self):
+        return get_object_or_404(Project, slug=self.kwargs["slug"]).lods.all()
+
+
+class ListCreateMeshVariantApi(GenericAPIView):
+    serializer_class = MeshVariantRequestSerializer
+
+    @extend_schema(
+        request=None,
+        responses={200: MeshVariantSerializer(many=True)},
+        operation_id="list_project_mesh_variants",
+    )
+    def get(self, request, slug):
+        project = get_object_or_404(Project, slug=slug)
+        return Response(
+            MeshVariantSerializer(
+                project.variants.order_by("-last_used"),
+                many=True,
+                context={"request": request},
+            ).data,
+            status=status.HTTP_200_OK,
+        )
+
+    @extend_schema(
+        description="Returns the cached mesh at once (200) or queues/joins its build (202)",
+        responses={200: MeshVariantSerializer, 202: MeshVariantSerializer},
+        operation_id="request_project_mesh_variant",
+    )
+    def post(self, request, slug):
+        project = get_object_or_404(Project, slug=slug)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        variant, ready = request_mesh_variant(project, **serializer.validated_data)
+        return Response(
+            MeshVariantSerializer(variant, context={"request": request}).data,
+            status=status.HTTP_200_OK if ready else status.HTTP_202_ACCEPTED,
+        )
+
+
+def volume_pending(project: Project) -> Response:
+    """Queue the project's volume and octree build and tell the client to retry."""
+    schedule_volume_build(project.pk)
+    return Response(
+        {"status": "pending"},
+        status=status.HTTP_202_ACCEPTED,
+        headers={"Retry-After": settings.DICOM_REBUILD_DELAY or 1},
+    )
+
+
+class RetrieveProjectPointCloudApi(GenericAPIView):
+    serializer_class = PointCloudQuerySerializer
+
+    @extend_schema(
+        parameters=[PointCloudQuerySerializer],
+        description="Packed little-endian points: 3 float32 (x, y, z) and an uint16 "
+        "value each, with a PLY header for encoding=ply. A missing volume is "
+        "queued for building and answered with 202",
+        responses={
+            (200, "application/octet-stream"): OpenApiTypes.BINARY,
+            202: OpenApiTypes.OBJECT,
+        },
+        operation_id="get_project_point_cloud",
+    )
+    def get(self, request, slug):
+        project = get_object_or_404(Project, slug=slug)
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        value_range = None
+        if "min" in query or "max" in query:
+            value_range = (
+                query.get("min", float("-inf")),
+                query.get("max", float("inf")),
+            )
+
+        volume = load_volume(project)
+        if volume is None:
+            return volume_pending(project)
+        points = generate_3d_point_cloud(
+            volume, query["stride"], query["threshold"], value_range
+        )
+        response = StreamingHttpResponse(
+            point_cloud_stream(points, query["encoding"]),
+            content_type="application/octet-stream",
+        )
+        response["X-Point-Count"] = len(points)
+        return response
+
+
+class RetrieveProjectOctreeApi(GenericAPIView):
+    serializer_class = OctreeQuerySerializer
+
+    @extend_schema(
+        parameters=[OctreeQuerySerializer],
+        description="Octree points inside a voxel box, packed like the point cloud. "
+        "Coarser depths return cell centroids with the maximum value of the cell, "
+        "X-Truncated is set when the box holds more than `limit` points. "
+        "A missing octree is queued for building and answered with 202",
+        responses={
+            (200, "application/octet-stream"): OpenApiTypes.BINARY,
+            202: OpenApiTypes.OBJECT,
+        },
+        operation_id="get_project_octree",
+    )
+    def get(self, request, slug):
+        project = get_object_or_404(Project, slug=slug)
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+        big = 1 << 21
+        limit = min(
+            query.get("limit", settings.DICOM_OCTREE_QUERY_MAX_POINTS),
+            settings.DICOM_OCTREE_QUERY_MAX_POINTS,
+        )
+
+        result = query_octree(
+            project,
+            (query["x0"], query["y0"], query["z0"]),
+            (query.get("x1", big), query.get("y1", big), query.get("z1", big)),
+            query["depth"],
+            limit,
+        )
+        if result is None:
+            return volume_pending(project)
+        points, truncated = result
+        response = StreamingHttpResponse(
+            point_cloud_stream(points, query["encoding"]),
+            content_type="application/octet-stream",
+        )
+        response["X-Point-Count"] = len(points)
+        response["X-Truncated"] = int(truncated)
+        return response
+
+
 class GeneratePatology(generics.CreateAPIView):
     serializer_class = PatologyGenerateSerializer
 
@@ -255,9 +647,21 @@ class GeneratePatology(generics.CreateAPIView):
 class CreateLayerApi(generics.CreateAPIView):
     serializer_class = LayerSerializer
 
+    def perform_create(self, serializer):
+        layer = serializer.save()
+        invalidate_shapes(layer.dicom_id)
+
 
 class RetrieveUpdateDeleteLayerApi(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = LayerSerializer
     queryset = Layer.objects.all()
 
     lookup_field = "slug"
+
+    def perform_update(self, serializer):
+        layer = serializer.save()
+        invalidate_shapes(layer.dicom_id)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        invalidate_shapes(instance.dicom_id)
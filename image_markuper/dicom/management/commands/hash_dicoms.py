@@ -0,0 +1,50 @@
+from dicom.models import Dicom
+from dicom.services import read_fingerprint, store_dicom
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+
+class Command(BaseCommand):
+    help = "Move dicoms to their content address and index their headers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--drop-duplicates",
+            action="store_true",
+            help="delete later rows repeating a payload or SOP instance of their project",
+        )
+
+    def handle(self, *args, drop_duplicates, **options):
+        moved = dropped = 0
+        for dicom in (
+            Dicom.objects.filter(Q(sha256="") | Q(rows=None)).order_by("pk").iterator()
+        ):
+            old = dicom.file.name
+            with dicom.file.open("rb") as content:
+                fingerprint = read_fingerprint(content)
+                name = store_dicom(content, fingerprint.sha256)
+            Dicom.objects.filter(pk=dicom.pk).update(
+                file=name, sha256=fingerprint.sha256, **fingerprint.header
+            )
+            if old != name:
+                dicom.file.storage.delete(old)
+            moved += 1
+
+        if drop_duplicates:
+            seen = set()
+            for dicom in (
+                Dicom.objects.exclude(project=None)
+                .order_by("project_id", "pk")
+                .iterator()
+            ):
+                keys = {(dicom.project_id, "sha256", dicom.sha256)}
+                if dicom.sop_instance_uid:
+                    keys.add((dicom.project_id, "uid", dicom.sop_instance_uid))
+                if keys & seen:
+                    dicom.delete()
+                    dropped += 1
+                else:
+                    seen |= keys
+        self.stdout.write(
+            self.style.SUCCESS(f"moved {moved} dicoms, dropped {dropped} duplicates")
+        )
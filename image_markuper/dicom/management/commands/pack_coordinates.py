@@ -0,0 +1,59 @@
+from itertools import groupby
+
+from dicom.models import BaseShape, Coordinate
+from dicom.models.shapes import pack_coordinates
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import BinaryField, Case, Value, When
+
+
+class Command(BaseCommand):
+    help = "Move legacy Coordinate rows into the packed BaseShape.points column"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, batch_size, **options):
+        shapes = skipped = 0
+        while True:
+            with transaction.atomic():
+                ids = list(
+                    Coordinate.objects.values_list("shape_id", flat=True)
+                    .order_by("shape_id")
+                    .distinct()[:batch_size]
+                )
+                if not ids:
+                    break
+                rows = (
+                    Coordinate.objects.filter(shape_id__in=ids)
+                    .order_by("shape_id", "pk")
+                    .values("shape_id", "x", "y")
+                )
+                packed = {
+                    shape_id: pack_coordinates(list(points))
+                    for shape_id, points in groupby(rows, key=lambda x: x["shape_id"])
+                }
+                # shapes saved since points were introduced hold newer
+                # coordinates than their leftover rows, those are only dropped
+                updated = (
+                    BaseShape.objects.non_polymorphic()
+                    .filter(pk__in=list(packed), points=b"")
+                    .update(
+                        points=Case(
+                            *(
+                                When(pk=pk, then=Value(data))
+                                for pk, data in packed.items()
+                            ),
+                            output_field=BinaryField(),
+                        )
+                    )
+                )
+                Coordinate.objects.filter(shape_id__in=ids).delete()
+            shapes += updated
+            skipped += len(ids) - updated
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"packed coordinates of {shapes} shapes, "
+                f"dropped stale rows of {skipped} already packed"
+            )
+        )
@@ -0,0 +1,24 @@
+from collections import defaultdict
+
+from dicom.models import Layer
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized path of every layer from its parent links"
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        layers = list(Layer.objects.order_by("pk"))
+        children = defaultdict(list)
+        for layer in layers:
+            children[layer.parent_id].append(layer)
+
+        stack = [(x, "") for x in children[None]]
+        while stack:
+            layer, prefix = stack.pop()
+            layer.path = f"{prefix}{layer.slug}/"
+            stack.extend((x, layer.path) for x in children[layer.pk])
+        Layer.objects.bulk_update(layers, ["path"], batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f"rebuilt paths of {len(layers)} layers"))
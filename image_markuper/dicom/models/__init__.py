@@ -1,3 +1,4 @@
 # flake8: noqa
-from .base import Dicom, Layer, Project
+from .base import SLICE_ORDER, Dicom, Layer, MeshLevel, MeshVariant, Project
+from .jobs import UploadJob
 from .shapes import BaseShape, Circle, Coordinate, FreeHand, Roi, Ruler
@@ -1,13 +1,57 @@
+import hashlib
+from collections import defaultdict
+
 from dicom.models.shapes import BaseShape
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.urls import reverse
+from django.utils.functional import cached_property
 from utils.files import media_upload_path
+from utils.generators import generate_charset
 
 User = get_user_model()
 
+# slugs are drawn before insert and redrawn this often if the unique index
+# rejects one, 52**10 and 52**8 make a second draw already unlikely
+SLUG_ATTEMPTS = 5
+
+
+def generate_slug() -> str:
+    return generate_charset(10)
+
+
+def generate_layer_slug() -> str:
+    return generate_charset(8)
+
+
+class RandomSlugModel(models.Model):
+    """Model whose unique `slug` defaults to a random one, retried on conflict."""
+
+    slug_generator = staticmethod(generate_slug)
 
-class Project(models.Model):
+    class Meta:
+        abstract = True
+
+    def refresh_slug(self):
+        self.slug = self.slug_generator()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        for attempt in range(SLUG_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                taken = type(self)._base_manager.filter(slug=self.slug).exists()
+                if not taken or attempt == SLUG_ATTEMPTS - 1:
+                    raise
+                self.refresh_slug()
+
+
+class Project(RandomSlugModel):
     class PathologyType(models.IntegerChoices):
         no_pathology = 0, "Без патологий"
         covid_pathology_all = 1, "COVID-19; все доли; многочисленные; размер любой"
@@ -54,11 +98,27 @@ class Project(models.Model):
     pathology_type = models.IntegerField(choices=PathologyType.choices, default=0)
 
     user = models.ForeignKey(User, related_name="projects", on_delete=models.CASCADE)
-    slug = models.SlugField(max_length=10)
+    slug = models.SlugField(max_length=10, unique=True, default=generate_slug)
     stl = models.FileField(blank=True)
+    # content hash of `stl`, its strong ETag
+    stl_sha256 = models.CharField(max_length=64, blank=True)
+    ply = models.FileField(blank=True)
+    glb = models.FileField(blank=True)
+    # middle slice of the stack, its preview stands for the project
+    thumbnail = models.ForeignKey(
+        "Dicom", related_name="+", null=True, blank=True, on_delete=models.SET_NULL
+    )
 
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # keyset pages of the project list, alone or per filter
+        indexes = [
+            models.Index(fields=["-created"]),
+            models.Index(fields=["user", "-created"]),
+            models.Index(fields=["pathology_type", "-created"]),
+        ]
+
     def __str__(self):
         return f"{self.user.username}'s project"
 
@@ -66,20 +126,131 @@ class Project(models.Model):
     def user_username(self):
         return self.user.username
 
+    @property
+    def slices(self):
+        return self.files.order_by(*SLICE_ORDER)
+
+
+class MeshLevel(models.Model):
+    """One level of a project's mesh pyramid, LOD0 is full resolution."""
+
+    project = models.ForeignKey(Project, related_name="lods", on_delete=models.CASCADE)
+    level = models.PositiveSmallIntegerField()
+    file = models.FileField()
+    triangles = models.PositiveIntegerField()
+    size = models.PositiveBigIntegerField()
+
+    class Meta:
+        ordering = ["level"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["project", "level"], name="unique_project_mesh_level"
+            )
+        ]
+
+    def __str__(self):
+        return f"LOD{self.level} of {self.project}"
+
+
+class MeshVariant(models.Model):
+    """Mesh for a non default threshold, step or region, built on request."""
 
-class Dicom(models.Model):
-    slug = models.SlugField()
+    class Status(models.TextChoices):
+        pending = "pending", "Pending"
+        ready = "ready", "Ready"
+        failed = "failed", "Failed"
+
+    project = models.ForeignKey(
+        Project, related_name="variants", on_delete=models.CASCADE
+    )
+    key = models.CharField(max_length=64, unique=True)
+    threshold = models.FloatField()
+    step_size = models.PositiveSmallIntegerField(default=1)
+    roi = models.JSONField(null=True, blank=True)
+
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.pending
+    )
+    file = models.FileField(blank=True)
+    triangles = models.PositiveIntegerField(default=0)
+    size = models.PositiveBigIntegerField(default=0)
+
+    created = models.DateTimeField(auto_now_add=True)
+    # last status change, a lost build leaves it pending and stale
+    updated = models.DateTimeField(auto_now=True)
+    last_used = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.threshold} mesh of {self.project}"
+
+
+# slices along the stack normal, InstanceNumber for those without a position
+SLICE_ORDER = (
+    models.F("slice_position").asc(nulls_last=True),
+    "instance_number",
+    "pk",
+)
+
+
+class Dicom(RandomSlugModel):
+    slug = models.SlugField(unique=True, default=generate_slug)
 
     file = models.FileField(upload_to=media_upload_path)
+    # content address of `file`, rows with the same payload share one file
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    sop_instance_uid = models.CharField(max_length=64, blank=True)
+
+    # header fields indexed at ingest, see dicom.services.headers
+    study_instance_uid = models.CharField(max_length=64, blank=True, db_index=True)
+    series_instance_uid = models.CharField(max_length=64, blank=True)
+    instance_number = models.IntegerField(null=True, blank=True)
+    slice_location = models.FloatField(null=True, blank=True)
+    image_position = models.JSONField(null=True, blank=True)
+    image_orientation = models.JSONField(null=True, blank=True)
+    # image_position along the stack normal
+    slice_position = models.FloatField(null=True, blank=True)
+    slice_thickness = models.FloatField(null=True, blank=True)
+    pixel_spacing = models.JSONField(null=True, blank=True)
+    rows = models.PositiveIntegerField(null=True, blank=True)
+    columns = models.PositiveIntegerField(null=True, blank=True)
+    bits_allocated = models.PositiveSmallIntegerField(null=True, blank=True)
+    pixel_representation = models.PositiveSmallIntegerField(null=True, blank=True)
+    rescale_slope = models.FloatField(null=True, blank=True)
+    rescale_intercept = models.FloatField(null=True, blank=True)
+    transfer_syntax = models.CharField(max_length=64, blank=True)
     uploaded = models.DateTimeField(auto_now_add=True)
 
     project = models.ForeignKey(
         Project, related_name="files", null=True, on_delete=models.SET_NULL
     )
 
+    class Meta:
+        # duplicate checks while ingesting into a project
+        indexes = [
+            models.Index(fields=["project", "sha256"]),
+            models.Index(fields=["project", "sop_instance_uid"]),
+            # keyset pages of the dicom list
+            models.Index(fields=["-uploaded"]),
+            models.Index(fields=["project", "-uploaded"]),
+            # stack order of a series, see SLICE_ORDER
+            models.Index(
+                fields=[
+                    "project",
+                    "series_instance_uid",
+                    "slice_position",
+                    "instance_number",
+                ]
+            ),
+        ]
+
     def __str__(self):
         return self.file.name
 
+    @property
+    def content_key(self) -> str:
+        """Content hash of the file, files stored before hashing go by name."""
+        return self.sha256 or hashlib.sha256(self.file.name.encode()).hexdigest()
+
     @property
     def shapes(self):
         qs = BaseShape.objects.filter(layer_fk__dicom=self)
@@ -87,32 +258,117 @@ class Dicom(models.Model):
             return qs
         return None
 
-    def delete_shapes(self):
-        shapes = self.shapes
-        if shapes:
-            [x.destroy() for x in shapes]
+    @cached_property
+    def layer_list(self) -> list["Layer"]:
+        return list(self.layers.order_by("pk"))
+
+    def get_shapes(self) -> list[BaseShape]:
+        """
+        Every shape with its subclass fields in one query per shape type, and
+        `layer_fk` filled from `layer_list` instead of a query per shape.
+
+        The subclasses are read directly, polymorphic would refetch them in
+        chunks of a hundred.
+        """
+        layers = {x.pk: x for x in self.layer_list}
+        shapes = []
+        for model in BaseShape.__subclasses__():
+            shapes.extend(
+                model.objects.non_polymorphic().filter(layer_fk_id__in=list(layers))
+            )
+        for shape in shapes:
+            shape.layer_fk = layers[shape.layer_fk_id]
+        return sorted(shapes, key=lambda x: x.pk)
 
     def get_layers(self):
-        return self.layers.filter(parent__isnull=True).first().serialize_self()
+        return serialize_layer_tree(self.layer_list)
 
     def get_absolute_url(self):
         return reverse("get_update_delete_dicom", kwargs={"slug": self.slug})
 
 
-class Layer(models.Model):
+def serialize_layer_tree(layers: list["Layer"]) -> dict:
+    """
+    Nested dict of an already loaded (sub)tree, rooted at the one layer whose
+    parent is not part of `layers`; children keep the order of `layers`.
+    """
+    pks = {x.pk for x in layers}
+    children = defaultdict(list)
+    for layer in layers:
+        children[layer.parent_id if layer.parent_id in pks else None].append(layer)
+
+    def serialize(layer):
+        return {
+            "slug": layer.slug,
+            "name": layer.name,
+            "children": [serialize(x) for x in children[layer.pk]],
+        }
+
+    return serialize(children[None][0])
+
+
+class Layer(RandomSlugModel):
+    slug_generator = staticmethod(generate_layer_slug)
+
     parent = models.ForeignKey(
         "self", related_name="children", blank=True, null=True, on_delete=models.CASCADE
     )
     dicom = models.ForeignKey(Dicom, related_name="layers", on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
-    slug = models.SlugField(max_length=8)
+    slug = models.SlugField(max_length=8, unique=True, default=generate_layer_slug)
+    # materialized path, slugs from the root down to this layer, each
+    # followed by "/", so a subtree is one indexed prefix match
+    path = models.CharField(max_length=1024, db_index=True, editable=False)
+
+    def build_path(self) -> str:
+        return f"{self.parent.path if self.parent_id else ''}{self.slug}/"
+
+    def refresh_slug(self):
+        super().refresh_slug()
+        self.path = self.build_path()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.path = self.build_path()
+        return super().save(*args, **kwargs)
+
+    def get_descendants(self, include_self=True):
+        layers = Layer.objects.filter(path__startswith=self.path)
+        if not include_self:
+            layers = layers.exclude(pk=self.pk)
+        return layers
+
+    def get_ancestors(self):
+        return Layer.objects.filter(
+            slug__in=self.path.split("/")[:-2], dicom_id=self.dicom_id
+        ).order_by("path")
+
+    def get_shapes(self):
+        """Shapes on this layer and every layer below it."""
+        return BaseShape.objects.filter(layer_fk__path__startswith=self.path)
+
+    def move_to(self, parent: "Layer"):
+        """Reparent the subtree with one update of every path below it."""
+        if parent.dicom_id != self.dicom_id:
+            raise ValueError("layers can only be moved within their dicom")
+        if parent.path.startswith(self.path):
+            raise ValueError("a layer can not be moved below itself")
+        old, new = self.path, f"{parent.path}{self.slug}/"
+        with transaction.atomic():
+            Layer.objects.filter(pk=self.pk).update(parent=parent)
+            Layer.objects.filter(path__startswith=old).update(
+                path=Concat(Value(new), Substr("path", len(old) + 1))
+            )
+        self.parent, self.path = parent, new
+
+    def delete(self, *args, **kwargs):
+        if not self.path:
+            return super().delete(*args, **kwargs)
+        # the whole subtree at once rather than cascading level by level
+        return self.get_descendants().delete()
 
     def serialize_self(self):
-        return {
-            "slug": self.slug,
-            "name": self.name,
-            "children": [x.serialize_self() for x in self.children.all()],
-        }
+        return serialize_layer_tree(list(self.get_descendants().order_by("pk")))
 
     def __str__(self):
         return f"layer on {self.dicom}"
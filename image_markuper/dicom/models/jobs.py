@@ -0,0 +1,47 @@
+from dicom.models.base import Project, RandomSlugModel, User, generate_slug
+from django.db import models
+from django.urls import reverse
+
+
+class UploadJob(RandomSlugModel):
+    """Uploaded files waiting for, or gone through, the ingest task."""
+
+    class Status(models.TextChoices):
+        pending = "pending", "Pending"
+        running = "running", "Running"
+        done = "done", "Done"
+        failed = "failed", "Failed"
+
+    slug = models.SlugField(max_length=10, unique=True, default=generate_slug)
+    user = models.ForeignKey(User, related_name="upload_jobs", on_delete=models.CASCADE)
+    project = models.ForeignKey(
+        Project,
+        related_name="upload_jobs",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.pending
+    )
+    # storage names of the raw uploads, removed once ingested
+    sources = models.JSONField(default=list)
+
+    # DICOM files, archive members counted one by one
+    accepted = models.PositiveIntegerField(default=0)
+    rejected = models.PositiveIntegerField(default=0)
+    # already in the project, by content or SOPInstanceUID
+    duplicates = models.PositiveIntegerField(default=0)
+    # uploaded files not ingested yet, an archive counts once
+    uploads_pending = models.PositiveIntegerField(default=0)
+    bytes = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"upload {self.slug} of {self.user}"
+
+    def get_absolute_url(self):
+        return reverse("get_upload_job", kwargs={"slug": self.slug})
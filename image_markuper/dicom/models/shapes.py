@@ -1,6 +1,22 @@
+import numpy as np
 from django.db import models
 from polymorphic.models import PolymorphicModel
 
+# one (x, y) pair per point, float64 so values round-trip like FloatField did
+COORDINATE_DTYPE = np.dtype([("x", "<f8"), ("y", "<f8")])
+
+
+def pack_coordinates(coordinates) -> bytes:
+    points = np.empty(len(coordinates), dtype=COORDINATE_DTYPE)
+    points["x"] = [x["x"] for x in coordinates]
+    points["y"] = [x["y"] for x in coordinates]
+    return points.tobytes()
+
+
+def unpack_coordinates(data) -> list[dict]:
+    points = np.frombuffer(data or b"", dtype=COORDINATE_DTYPE)
+    return [{"x": x, "y": y} for x, y in points.tolist()]
+
 
 class BaseShape(PolymorphicModel):
     TYPE = "no_type"
@@ -9,6 +25,8 @@ class BaseShape(PolymorphicModel):
     layer_fk = models.ForeignKey(
         "dicom.Layer", related_name="shapes", on_delete=models.CASCADE
     )
+    # packed COORDINATE_DTYPE pairs, see pack_coordinates
+    points = models.BinaryField(default=bytes, editable=False)
 
     def serialize_self(self):
         return {
@@ -30,8 +48,12 @@ class BaseShape(PolymorphicModel):
         return self.layer_fk.slug
 
     @property
-    def coordinates(self) -> [(int, int)]:
-        return self.shape_coordinates.all().values("x", "y")
+    def coordinates(self) -> list[dict]:
+        return unpack_coordinates(self.points)
+
+    @coordinates.setter
+    def coordinates(self, value):
+        self.points = pack_coordinates(value)
 
     def destroy(self):
         try:
@@ -44,6 +66,8 @@ class BaseShape(PolymorphicModel):
 
 
 class Coordinate(models.Model):
+    """Legacy row per point, superseded by `BaseShape.points`."""
+
     x = models.FloatField()
     y = models.FloatField()
 
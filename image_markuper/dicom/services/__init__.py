@@ -0,0 +1,45 @@
+# flake8: noqa
+from .base import (
+    content_name,
+    create_coordinate,
+    create_dicoms,
+    get_bbox,
+    process_files,
+    read_fingerprint,
+    release_dicom_file,
+    replace_dicom_file,
+    store_dicom,
+)
+from .headers import header_dataset, header_fields
+from .jobs import create_upload_job, run_upload_job
+from .octree import build_octree, query_octree
+from .pixels import pixel_payload
+from .points import generate_3d_point_cloud, point_cloud_stream
+from .previews import (
+    generate_previews,
+    preview_urls,
+    schedule_previews,
+    update_project_thumbnail,
+)
+from .rebuild import (
+    build_volume_cache,
+    drop_project_caches,
+    generate_3d_model,
+    rebuild_project,
+    schedule_project_rebuild,
+    schedule_volume_build,
+)
+from .render import render_key, render_slice
+from .shape_cache import cached_shapes, invalidate_shapes, shape_cache_stats
+from .shapes import delete_shapes, replace_shapes
+from .variants import evict_mesh_variants, generate_mesh_variant, request_mesh_variant
+from .volume import (
+    Volume,
+    build_volume,
+    get_volume,
+    invalidate_volume,
+    load_volume,
+    project_slices,
+    sort_slices,
+    write_volume,
+)
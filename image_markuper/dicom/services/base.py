@@ -0,0 +1,276 @@
+import hashlib
+import shutil
+import zipfile
+from collections.abc import Callable, Iterator
+from pathlib import PurePosixPath
+from tempfile import SpooledTemporaryFile
+from typing import NamedTuple
+
+from dicom.models import Dicom, Layer, Project
+from dicom.services.headers import header_fields, read_header
+from dicom.services.pixels import delete_pixels
+from dicom.services.previews import schedule_previews
+from dicom.services.rebuild import drop_project_caches
+from dicom.services.render import delete_renders
+from dicom.services.volume import get_volume
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from pydicom.dataset import Dataset
+from pydicom.errors import InvalidDicomError
+
+# dicoms inserted per statement while ingesting uploads
+BULK_CREATE_BATCH = 100
+
+DICOM_PREAMBLE = 128
+DICOM_MAGIC = b"DICM"
+DICOM_HEAD_SIZE = DICOM_PREAMBLE + len(DICOM_MAGIC)
+
+# payloads live at dicom/<aa>/<bb>/<sha256>.dcm, shared by every row of them
+DICOM_CONTENT_ROOT = "dicom"
+# archive members above this are decompressed to disk instead of memory
+DICOM_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class Fingerprint(NamedTuple):
+    sha256: str
+    # `Dicom` column values of the header, empty if it does not parse
+    header: dict
+
+    @property
+    def sop_instance_uid(self) -> str:
+        return self.header.get("sop_instance_uid", "")
+
+
+def read_head(file) -> bytes:
+    file.seek(0)
+    head = file.read(DICOM_HEAD_SIZE)
+    file.seek(0)
+    return head
+
+
+def is_dicom(head: bytes) -> bool:
+    """Part 10 files carry "DICM" right after their 128 byte preamble."""
+    return head[DICOM_PREAMBLE:DICOM_HEAD_SIZE] == DICOM_MAGIC
+
+
+def content_name(sha256: str) -> str:
+    """Fanned out storage name of a payload, two directory levels by its hash."""
+    return f"{DICOM_CONTENT_ROOT}/{sha256[:2]}/{sha256[2:4]}/{sha256}.dcm"
+
+
+def read_fingerprint(content: File) -> Fingerprint:
+    digest = hashlib.sha256()
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    content.seek(0)
+    try:
+        header = header_fields(read_header(content))
+    except (InvalidDicomError, EOFError, ValueError):
+        header = {}
+    content.seek(0)
+    return Fingerprint(digest.hexdigest(), header)
+
+
+def store_dicom(content: File, sha256: str) -> str:
+    """
+    Save a payload under its content address where `Dicom.file` keeps them,
+    unless it is stored already, and return the storage name.
+    """
+    storage = Dicom._meta.get_field("file").storage
+    name = content_name(sha256)
+    if storage.exists(name):
+        return name
+    return storage.save(name, content)
+
+
+def release_dicom_file(dicom: Dicom):
+    """
+    Delete the payload of a deleted or replaced `dicom`, and the renders and
+    pixel frames made of it, once the transaction commits, unless a committed
+    row still has its hash then. Files stored before hashing belong to one
+    row alone.
+    """
+    storage, name = dicom.file.storage, dicom.file.name
+    sha256, content_key = dicom.sha256, dicom.content_key
+
+    def delete():
+        if sha256 and Dicom.objects.filter(sha256=sha256).exists():
+            return
+        storage.delete(name)
+        delete_renders(content_key)
+        delete_pixels(content_key)
+
+    transaction.on_commit(delete)
+
+
+def spool_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> Iterator[File]:
+    """
+    Decompress one archive member once, into memory or a temporary file past
+    `DICOM_SPOOL_MAX_SIZE`, so it can be hashed and then stored.
+    """
+    with archive.open(info) as member, SpooledTemporaryFile(
+        DICOM_SPOOL_MAX_SIZE
+    ) as spool:
+        shutil.copyfileobj(member, spool, HASH_CHUNK_SIZE)
+        spool.seek(0)
+        yield File(spool, name=PurePosixPath(info.filename).name)
+
+
+def iter_dicoms(file) -> Iterator[File | None]:
+    """
+    The DICOM files of one upload, None per rejected file. Archive members
+    are only readable until the next one is asked for.
+    """
+    if is_dicom(read_head(file)):
+        yield File(file, name=PurePosixPath(file.name).name)
+    elif zipfile.is_zipfile(file):
+        with zipfile.ZipFile(file) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as member:
+                    head = member.read(DICOM_HEAD_SIZE)
+                if is_dicom(head):
+                    yield from spool_member(archive, info)
+                else:
+                    yield None
+    else:
+        yield None
+
+
+def is_duplicate(
+    project: Project, fingerprint: Fingerprint, exclude: Dicom | None = None
+) -> bool:
+    """Whether `project` has this payload or SOP instance, one indexed lookup."""
+    condition = Q(sha256=fingerprint.sha256)
+    if fingerprint.sop_instance_uid:
+        condition |= Q(sop_instance_uid=fingerprint.sop_instance_uid)
+    files = project.files.filter(condition)
+    if exclude is not None:
+        files = files.exclude(pk=exclude.pk)
+    return files.exists()
+
+
+def replace_dicom_file(dicom: Dicom, content: File) -> Dicom:
+    """
+    Swap the payload of a saved dicom for `content`, refreshing its hash and
+    indexed header, and drop what was derived from the old one.
+
+    Renders and pixel frames are keyed by content and follow by themselves,
+    the project's volume and meshes are rebuilt.
+    """
+    if not is_dicom(read_head(content)):
+        raise ValueError("not a DICOM file")
+    fingerprint = read_fingerprint(content)
+    if fingerprint.sha256 == dicom.sha256:
+        return dicom
+    if dicom.project is not None and is_duplicate(dicom.project, fingerprint, dicom):
+        raise ValueError("the project has this file already")
+
+    previous = Dicom(file=dicom.file.name, sha256=dicom.sha256)
+    dicom.file = store_dicom(content, fingerprint.sha256)
+    dicom.sha256 = fingerprint.sha256
+    # tags the new header lacks are cleared, not kept from the old one
+    for field, value in {**header_fields(Dataset()), **fingerprint.header}.items():
+        setattr(dicom, field, value)
+    dicom.save()
+    release_dicom_file(previous)
+    if dicom.project_id:
+        drop_project_caches(dicom.project_id)
+    schedule_previews([dicom])
+    return dicom
+
+
+def process_files(
+    files, project: Project, progress: Callable[[int, int, int], None] | None = None
+) -> tuple[int, int, int]:
+    """
+    Ingest plain DICOM files and ZIP archives of them into `project`,
+    `BULK_CREATE_BATCH` rows at a time, anything else is rejected. Files
+    the project has already, by content or SOPInstanceUID, are skipped
+    without storing them again.
+
+    `progress(accepted, rejected, duplicates)` gets the counts of every batch
+    as it lands, the totals are returned.
+    """
+    accepted = rejected = duplicates = 0
+    batch, skipped, repeated = [], 0, 0
+    # payloads and instances of the batch not inserted yet
+    hashes, uids = set(), set()
+
+    def flush():
+        nonlocal accepted, rejected, duplicates, batch, skipped, repeated
+        if batch:
+            create_dicoms(batch, project)
+        if progress is not None:
+            progress(len(batch), skipped, repeated)
+        accepted += len(batch)
+        rejected += skipped
+        duplicates += repeated
+        batch, skipped, repeated = [], 0, 0
+        hashes.clear()
+        uids.clear()
+
+    for file in files:
+        for content in iter_dicoms(file):
+            if content is None:
+                skipped += 1
+                continue
+            fingerprint = read_fingerprint(content)
+            if (
+                fingerprint.sha256 in hashes
+                or fingerprint.sop_instance_uid in uids
+                or is_duplicate(project, fingerprint)
+            ):
+                repeated += 1
+                continue
+            hashes.add(fingerprint.sha256)
+            if fingerprint.sop_instance_uid:
+                uids.add(fingerprint.sop_instance_uid)
+            batch.append(
+                Dicom(
+                    file=store_dicom(content, fingerprint.sha256),
+                    sha256=fingerprint.sha256,
+                    **fingerprint.header,
+                )
+            )
+            if len(batch) == BULK_CREATE_BATCH:
+                flush()
+    flush()
+    return accepted, rejected, duplicates
+
+
+def create_dicoms(dicoms: list[Dicom], project: Project | None = None) -> list[Dicom]:
+    """
+    Insert unsaved dicoms, whose files are in storage already, and their root
+    layers with one bulk insert each, instead of the per-row post_save work
+    of `Dicom.objects.create`.
+    """
+    for dicom in dicoms:
+        dicom.project = project
+    dicoms = Dicom.objects.bulk_create(dicoms)
+    layers = [Layer(parent=None, dicom=x, name="root") for x in dicoms]
+    for layer in layers:
+        layer.path = layer.build_path()
+    Layer.objects.bulk_create(layers)
+    if project is not None:
+        drop_project_caches(project.pk)
+    schedule_previews(dicoms)
+    return dicoms
+
+
+def create_coordinate(coordinates, obj):
+    obj.coordinates = coordinates
+    obj.save(update_fields=["points"])
+
+
+def get_bbox(project_id, points, image_range):
+    project: Project = Project.objects.get(slug=project_id)
+    volume = get_volume(project, rescale=False)
+    return volume.data[
+        image_range[0] : image_range[1] + 1,  # noqa
+        int(points[0]["x"]) : int(points[1]["x"]),  # noqa
+        int(points[0]["y"]) : int(points[1]["y"]),  # noqa
+    ].tolist()
@@ -0,0 +1,95 @@
+"""
+Slice decoding. Pool workers only run the functions of this module, which
+use pydicom and numpy and never touch Django or the database.
+"""
+import contextlib
+import tempfile
+
+import billiard
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset
+
+
+def rescale_params(header: Dataset) -> tuple[float, float]:
+    return (
+        float(header.get("RescaleSlope", 1) or 1),
+        float(header.get("RescaleIntercept", 0) or 0),
+    )
+
+
+def decode_slice(path: str, out: np.ndarray, rescale: bool = True):
+    """Decode one slice into its preallocated plane, rescaling in place."""
+    dataset = pydicom.dcmread(path)
+    np.copyto(out, dataset.pixel_array, casting="unsafe")
+    if rescale:
+        slope, intercept = rescale_params(dataset)
+        if slope != 1:
+            out *= slope
+        if intercept != 0:
+            out += intercept
+
+
+def decode_chunk(
+    target: tuple[str, int], shape, dtype, chunk: list[tuple[int, str]], rescale
+):
+    """Pool worker: map the volume file at `target` and decode a run of slices."""
+    filename, offset = target
+    volume = np.memmap(filename, dtype=dtype, mode="r+", offset=offset, shape=shape)
+    try:
+        for index, path in chunk:
+            decode_slice(path, volume[index], rescale)
+        volume.flush()
+    finally:
+        del volume
+
+
+def decode_parallel(
+    paths: list[str], out: np.ndarray, rescale: bool, workers: int, chunk_size: int
+):
+    """
+    Decode `paths` into the planes of `out` with a process pool, since
+    parsing and most pixel decoders hold the GIL.
+
+    billiard, Celery's fork of multiprocessing, because volumes are built in
+    Celery's daemonic prefork children, where multiprocessing refuses to
+    start processes. Workers write a memory-mapped `out` in place, anything
+    else goes through a temporary file that is copied back once.
+    """
+    chunks = [
+        [(int(i), paths[i]) for i in part]
+        for part in np.array_split(np.arange(len(paths)), -(-len(paths) // chunk_size))
+    ]
+    with contextlib.ExitStack() as stack:
+        if isinstance(out, np.memmap) and out.filename:
+            out.flush()
+            target, volume = (out.filename, out.offset), out
+        else:
+            spool = stack.enter_context(tempfile.NamedTemporaryFile())
+            volume = np.memmap(spool.name, dtype=out.dtype, mode="w+", shape=out.shape)
+            target = (spool.name, 0)
+        with billiard.Pool(workers) as pool:
+            results = [
+                pool.apply_async(
+                    decode_chunk, (target, out.shape, out.dtype, chunk, rescale)
+                )
+                for chunk in chunks
+            ]
+            for result in results:
+                result.get()
+        if volume is not out:
+            np.copyto(out, volume)
+
+
+def decode_slices(
+    paths: list[str],
+    out: np.ndarray,
+    rescale: bool = True,
+    workers: int = 1,
+    chunk_size: int = 16,
+):
+    if workers > 1 and len(paths) > chunk_size:
+        decode_parallel(paths, out, rescale, workers, chunk_size)
+        return
+    for plane, path in zip(out, paths):
+        decode_slice(path, plane, rescale)
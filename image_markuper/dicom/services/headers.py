@@ -0,0 +1,115 @@
+"""
+Header fields indexed on `Dicom` at ingest, so slices are ordered, filtered
+and grouped in SQL and volumes are laid out without parsing every file.
+"""
+import numpy as np
+import pydicom
+from dicom.models import Dicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import UID
+
+
+def slice_position(header: Dataset) -> float | None:
+    """Position of the slice along the stack normal, if the header has one."""
+    position = header.get("ImagePositionPatient")
+    if position is None:
+        return None
+    orientation = header.get("ImageOrientationPatient")
+    if orientation is None:
+        return float(position[2])
+    normal = np.cross(
+        np.asarray(orientation[:3], dtype=float),
+        np.asarray(orientation[3:], dtype=float),
+    )
+    return float(np.dot(normal, np.asarray(position, dtype=float)))
+
+
+def slice_spacing(positions: list[float | None], thickness: float | None):
+    """
+    Median distance between consecutive slice positions, or `thickness` when
+    a position is missing or the slices do not step along the stack.
+    """
+    if len(positions) > 1 and None not in positions:
+        step = np.median(np.abs(np.diff(positions)))
+        if step > 0:
+            return float(step)
+    return thickness
+
+
+def read_header(file) -> Dataset:
+    return pydicom.dcmread(file, stop_before_pixels=True)
+
+
+def header_fields(header: Dataset) -> dict:
+    """`Dicom` column values of one parsed header, missing tags left empty."""
+
+    def value(keyword, cast):
+        found = header.get(keyword)
+        if found is None or found == "":
+            return None
+        return cast(found)
+
+    def floats(found):
+        return [float(x) for x in found]
+
+    file_meta = getattr(header, "file_meta", None)
+    return {
+        "sop_instance_uid": str(header.get("SOPInstanceUID", "")),
+        "study_instance_uid": str(header.get("StudyInstanceUID", "")),
+        "series_instance_uid": str(header.get("SeriesInstanceUID", "")),
+        "instance_number": value("InstanceNumber", int),
+        "slice_location": value("SliceLocation", float),
+        "image_position": value("ImagePositionPatient", floats),
+        "image_orientation": value("ImageOrientationPatient", floats),
+        "slice_position": slice_position(header),
+        "slice_thickness": value("SliceThickness", float),
+        "pixel_spacing": value("PixelSpacing", floats),
+        "rows": value("Rows", int),
+        "columns": value("Columns", int),
+        "bits_allocated": value("BitsAllocated", int),
+        "pixel_representation": value("PixelRepresentation", int),
+        "rescale_slope": value("RescaleSlope", float),
+        "rescale_intercept": value("RescaleIntercept", float),
+        "transfer_syntax": str(file_meta.get("TransferSyntaxUID", ""))
+        if file_meta is not None
+        else "",
+    }
+
+
+def is_indexed(dicom: Dicom) -> bool:
+    """Rows ingested before the header index have no geometry on them."""
+    return dicom.rows is not None
+
+
+def header_dataset(dicom: Dicom) -> Dataset:
+    """The indexed header fields of `dicom` as a dataset, without opening it."""
+    header = Dataset()
+    for keyword, attr in (
+        ("SOPInstanceUID", "sop_instance_uid"),
+        ("StudyInstanceUID", "study_instance_uid"),
+        ("SeriesInstanceUID", "series_instance_uid"),
+        ("InstanceNumber", "instance_number"),
+        ("SliceLocation", "slice_location"),
+        ("ImagePositionPatient", "image_position"),
+        ("ImageOrientationPatient", "image_orientation"),
+        ("SliceThickness", "slice_thickness"),
+        ("PixelSpacing", "pixel_spacing"),
+        ("Rows", "rows"),
+        ("Columns", "columns"),
+        ("BitsAllocated", "bits_allocated"),
+        ("PixelRepresentation", "pixel_representation"),
+        ("RescaleSlope", "rescale_slope"),
+        ("RescaleIntercept", "rescale_intercept"),
+    ):
+        found = getattr(dicom, attr)
+        if found is not None and found != "":
+            setattr(header, keyword, found)
+
+    header.file_meta = FileMetaDataset()
+    header.is_little_endian = True
+    if dicom.transfer_syntax:
+        syntax = UID(dicom.transfer_syntax)
+        header.file_meta.TransferSyntaxUID = syntax
+        if syntax.is_transfer_syntax:
+            header.is_little_endian = syntax.is_little_endian
+    return header
@@ -0,0 +1,67 @@
+import logging
+
+from dicom import tasks
+from dicom.models import Project, UploadJob
+from dicom.services.base import process_files
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# raw uploads are parked here until their job has ingested them
+UPLOAD_JOB_ROOT = "uploads/jobs"
+# what a failed job reports, the exception itself goes to the log only
+UPLOAD_JOB_ERROR = "The upload could not be processed."
+
+
+def create_upload_job(files, user, project: Project | None = None) -> UploadJob:
+    """
+    Store the raw uploads and queue their ingest once the request commits,
+    so the request only pays for writing the files once.
+    """
+    job = UploadJob.objects.create(
+        user=user,
+        project=project,
+        uploads_pending=len(files),
+        bytes=sum(x.size for x in files),
+    )
+    job.sources = [
+        default_storage.save(f"{UPLOAD_JOB_ROOT}/{job.slug}/{x.name}", x) for x in files
+    ]
+    job.save(update_fields=["sources"])
+    transaction.on_commit(lambda: tasks.process_upload_job.delay(pk=job.pk))
+    return job
+
+
+def run_upload_job(job: UploadJob):
+    """Ingest every stored upload of `job`, keeping its counters current."""
+    jobs = UploadJob.objects.filter(pk=job.pk)
+
+    def progress(accepted: int, rejected: int, duplicates: int):
+        jobs.update(
+            accepted=F("accepted") + accepted,
+            rejected=F("rejected") + rejected,
+            duplicates=F("duplicates") + duplicates,
+        )
+
+    try:
+        if job.project is None:
+            job.project = Project.objects.create(user=job.user)
+        jobs.update(status=UploadJob.Status.running, project=job.project)
+        for name in job.sources:
+            if default_storage.exists(name):
+                with default_storage.open(name) as file:
+                    process_files([file], job.project, progress)
+                default_storage.delete(name)
+            jobs.update(uploads_pending=F("uploads_pending") - 1)
+    except Exception:
+        logger.exception("upload job %s failed", job.slug)
+        jobs.update(
+            status=UploadJob.Status.failed,
+            error=UPLOAD_JOB_ERROR,
+            finished=timezone.now(),
+        )
+        raise
+    jobs.update(status=UploadJob.Status.done, finished=timezone.now())
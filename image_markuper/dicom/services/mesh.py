@@ -0,0 +1,341 @@
+import hashlib
+import io
+import json
+import struct
+from collections.abc import Callable
+
+import numpy as np
+from dicom.models import MeshLevel, Project
+from dicom.services.volume import Volume
+from django.conf import settings
+from django.core.files.base import ContentFile
+from skimage import measure
+from stl.mesh import Mesh
+from utils.generators import generate_charset
+
+# float32 slab plus marching cubes' own per-plane bookkeeping
+MARCHING_CUBES_OVERHEAD = 3
+
+
+def marching_cubes(volume: np.ndarray, threshold: float, step_size: int = 1):
+    verts, faces, normals, values = measure.marching_cubes(
+        volume, threshold, step_size=step_size
+    )
+    return verts, faces, normals
+
+
+def slab_planes(volume: Volume, step_size: int) -> int:
+    """Planes per slab that fit DICOM_MESH_MEMORY_LIMIT, aligned to the step."""
+    plane_bytes = volume.data[0].size * 4 * MARCHING_CUBES_OVERHEAD
+    planes = max(settings.DICOM_MESH_MEMORY_LIMIT // plane_bytes, step_size + 1)
+    return planes - (planes - 1) % step_size
+
+
+def vertex_normals(verts: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    """Area weighted face normals, pointing down the gradient like skimage's."""
+    triangles = verts[faces]
+    face_normals = np.cross(
+        triangles[:, 2] - triangles[:, 0], triangles[:, 1] - triangles[:, 0]
+    )
+    normals = np.zeros_like(verts)
+    for i in range(3):
+        np.add.at(normals, faces[:, i], face_normals)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None]
+    return normals
+
+
+def marching_cubes_chunked(
+    volume: Volume, threshold: float, step_size: int, planes: int
+):
+    """
+    Marching cubes over slabs of `planes` slices that share their boundary
+    plane, so only one slab is decoded to float32 at a time.
+
+    Cells never span two slabs and seam vertices are interpolated from the
+    same two voxels on both sides, so merging equal seam vertices gives the
+    single-shot geometry. Normals are taken from the faces, since the volume
+    gradient is one-sided at a slab border.
+    """
+    verts, faces, seams = [], [], []
+    offset = 0
+    depth = len(volume.data)
+    for start in range(0, depth - 1, planes - 1):
+        slab = volume.slab(start, min(start + planes, depth)).modality().data
+        try:
+            slab_verts, slab_faces, _ = marching_cubes(slab, threshold, step_size)
+        except (ValueError, RuntimeError):
+            # no crossing of the level inside this slab
+            continue
+        slab_verts[:, 0] += start
+        verts.append(slab_verts)
+        faces.append(slab_faces + offset)
+        offset += len(slab_verts)
+        seams.append(start)
+    if not verts:
+        raise RuntimeError("No surface found at the given iso value.")
+    verts = np.concatenate(verts)
+    faces = np.concatenate(faces)
+
+    index = np.arange(len(verts))
+    seam = np.flatnonzero(np.isin(verts[:, 0], np.array(seams, dtype=verts.dtype)))
+    _, first, inverse = np.unique(
+        verts[seam], axis=0, return_index=True, return_inverse=True
+    )
+    index[seam] = seam[first][inverse.reshape(-1)]
+    faces = index[faces]
+
+    used = np.zeros(len(verts), dtype=bool)
+    used[faces] = True
+    remap = np.cumsum(used) - 1
+    verts, faces = verts[used], remap[faces]
+    return verts, faces, vertex_normals(verts, faces)
+
+
+def extract_surface(volume: Volume, threshold: float, step_size: int = 1):
+    """
+    Marching cubes over a (slice, row, column) volume in modality units,
+    chunked when the whole volume does not fit DICOM_MESH_MEMORY_LIMIT.
+
+    Vertices and normals are returned as (column, row, slice) and the winding
+    reversed to undo the axis swap, matching the original transposed layout.
+    """
+    planes = slab_planes(volume, step_size)
+    if planes >= len(volume.data):
+        verts, faces, normals = marching_cubes(
+            volume.modality().data, threshold, step_size
+        )
+    else:
+        verts, faces, normals = marching_cubes_chunked(
+            volume, threshold, step_size, planes
+        )
+    return verts[:, ::-1], faces[:, ::-1], normals[:, ::-1]
+
+
+def decimate(verts: np.ndarray, faces: np.ndarray, normals: np.ndarray, cell: float):
+    """Vertex clustering: every vertex inside one `cell`-sized box becomes one."""
+    keys = np.floor(verts / cell).astype(np.int64)
+    keys -= keys.min(axis=0, initial=0)
+    keys = np.ravel_multi_index(keys.T, keys.max(axis=0, initial=0) + 1)
+    _, cluster, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    cluster = cluster.reshape(-1)
+
+    def average(values):
+        return np.stack(
+            [
+                np.bincount(cluster, weights=values[:, i], minlength=len(counts))
+                for i in range(3)
+            ],
+            axis=1,
+        )
+
+    verts = average(verts) / counts[:, None]
+    normals = average(normals)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None]
+
+    faces = cluster[faces]
+    faces = faces[
+        (faces[:, 0] != faces[:, 1])
+        & (faces[:, 1] != faces[:, 2])
+        & (faces[:, 0] != faces[:, 2])
+    ]
+    _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    faces = faces[np.sort(first)]
+
+    used = np.zeros(len(verts), dtype=bool)
+    used[faces] = True
+    remap = np.cumsum(used) - 1
+    return verts[used], remap[faces], normals[used]
+
+
+def to_stl(verts: np.ndarray, faces: np.ndarray, normals: np.ndarray) -> bytes:
+    solid = Mesh(np.zeros(faces.shape[0], dtype=Mesh.dtype))
+    solid.vectors[:] = verts[faces]
+    buffer = io.BytesIO()
+    solid.save("model.stl", fh=buffer)
+    return buffer.getvalue()
+
+
+def wound_outward(faces: np.ndarray) -> np.ndarray:
+    """
+    Faces counter-clockwise seen from outside, front faces for PLY and glTF
+    viewers. extract_surface keeps the STL winding, which is the reverse.
+    """
+    return np.ascontiguousarray(faces[:, ::-1])
+
+
+def to_ply(verts: np.ndarray, faces: np.ndarray, normals: np.ndarray) -> bytes:
+    """Binary little-endian PLY with shared vertices and per-vertex normals."""
+    header = "\n".join(
+        [
+            "ply",
+            "format binary_little_endian 1.0",
+            f"element vertex {len(verts)}",
+            *(f"property float {x}" for x in ("x", "y", "z", "nx", "ny", "nz")),
+            f"element face {len(faces)}",
+            "property list uchar int vertex_indices",
+            "end_header\n",
+        ]
+    )
+    vertex = np.empty(len(verts), dtype=[("xyz", "<f4", 3), ("normal", "<f4", 3)])
+    vertex["xyz"] = verts
+    vertex["normal"] = normals
+    face = np.empty(len(faces), dtype=[("count", "u1"), ("indices", "<i4", 3)])
+    face["count"] = 3
+    face["indices"] = wound_outward(faces)
+    return header.encode() + vertex.tobytes() + face.tobytes()
+
+
+def to_glb(verts: np.ndarray, faces: np.ndarray, normals: np.ndarray) -> bytes:
+    """Binary glTF 2.0 with one indexed triangle primitive."""
+    positions = np.ascontiguousarray(verts, dtype="<f4")
+    normals = np.ascontiguousarray(normals, dtype="<f4")
+    indices = wound_outward(faces).astype("<u4")
+    views = [positions.tobytes(), normals.tobytes(), indices.tobytes()]
+    offsets = np.cumsum([0] + [len(x) for x in views])
+
+    gltf = {
+        "asset": {"version": "2.0", "generator": "image_markuper"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [
+            {"primitives": [{"attributes": {"POSITION": 0, "NORMAL": 1}, "indices": 2}]}
+        ],
+        "buffers": [{"byteLength": int(offsets[-1])}],
+        "bufferViews": [
+            {
+                "buffer": 0,
+                "byteOffset": int(offsets[i]),
+                "byteLength": len(view),
+                "target": 34963 if i == 2 else 34962,
+            }
+            for i, view in enumerate(views)
+        ],
+        "accessors": [
+            {
+                "bufferView": 0,
+                "componentType": 5126,
+                "count": len(positions),
+                "type": "VEC3",
+                "min": positions.min(axis=0).tolist() if len(positions) else [0] * 3,
+                "max": positions.max(axis=0).tolist() if len(positions) else [0] * 3,
+            },
+            {
+                "bufferView": 1,
+                "componentType": 5126,
+                "count": len(normals),
+                "type": "VEC3",
+            },
+            {
+                "bufferView": 2,
+                "componentType": 5125,
+                "count": indices.size,
+                "type": "SCALAR",
+            },
+        ],
+    }
+    content = json.dumps(gltf, separators=(",", ":")).encode()
+    content += b" " * (-len(content) % 4)
+    binary = b"".join(views)
+    binary += b"\0" * (-len(binary) % 4)
+
+    return b"".join(
+        [
+            struct.pack("<4sII", b"glTF", 2, 12 + 8 + len(content) + 8 + len(binary)),
+            struct.pack("<I4s", len(content), b"JSON"),
+            content,
+            struct.pack("<I4s", len(binary), b"BIN\0"),
+            binary,
+        ]
+    )
+
+
+MESH_FORMATS = {
+    "stl": to_stl,
+    "ply": to_ply,
+    "glb": to_glb,
+}
+
+
+def save_mesh(project: Project, verts, faces, normals):
+    """
+    Write the full resolution mesh to every format in DICOM_MESH_FORMATS next
+    to `Project.stl` and record it as LOD0 of the pyramid.
+    """
+    name = generate_charset(4)
+    fields = []
+    sizes = {}
+    replaced = []
+    for extension in settings.DICOM_MESH_FORMATS:
+        content = MESH_FORMATS[extension](verts, faces, normals)
+        file = getattr(project, extension)
+        if file:
+            replaced.append((file.storage, file.name))
+        file.save(f"{name}.{extension}", ContentFile(content), save=False)
+        fields.append(extension)
+        sizes[extension] = len(content)
+        if extension == "stl":
+            project.stl_sha256 = hashlib.sha256(content).hexdigest()
+            fields.append("stl_sha256")
+    project.save(update_fields=fields)
+
+    extension = settings.DICOM_MESH_FORMATS[0]
+    MeshLevel.objects.update_or_create(
+        project=project,
+        level=0,
+        defaults={
+            "file": getattr(project, extension).name,
+            "triangles": len(faces),
+            "size": sizes[extension],
+        },
+    )
+    # the previous LOD0 is one of these, drop them once nothing points at them
+    for storage, name in replaced:
+        storage.delete(name)
+
+
+def save_mesh_level(project: Project, level: int, verts, faces, normals):
+    extension = settings.DICOM_MESH_FORMATS[0]
+    content = MESH_FORMATS[extension](verts, faces, normals)
+    mesh_level, _ = MeshLevel.objects.get_or_create(
+        project=project, level=level, defaults={"triangles": 0, "size": 0}
+    )
+    replaced = mesh_level.file.name
+    mesh_level.file.save(
+        f"{generate_charset(4)}_lod{level}.{extension}",
+        ContentFile(content),
+        save=False,
+    )
+    mesh_level.triangles = len(faces)
+    mesh_level.size = len(content)
+    mesh_level.save()
+    if replaced:
+        mesh_level.file.storage.delete(replaced)
+    return mesh_level
+
+
+def generate_mesh_pyramid(
+    project: Project,
+    volume: Volume,
+    threshold: float,
+    superseded: Callable[[], bool] | None = None,
+) -> bool:
+    """
+    Build LODn..LOD1 from coarse marching cubes plus vertex clustering, coarsest
+    first so the viewer has something to show early, then the full LOD0 mesh.
+
+    Stops between levels and returns False once `superseded` says a newer
+    build is on its way.
+    """
+    steps = settings.DICOM_MESH_LOD_STEPS
+    for level, step in reversed(list(enumerate(steps, start=1))):
+        if superseded is not None and superseded():
+            return False
+        verts, faces, normals = extract_surface(volume, threshold, step)
+        save_mesh_level(project, level, *decimate(verts, faces, normals, 2 * step))
+    MeshLevel.objects.filter(project=project, level__gt=len(steps)).delete()
+    verts, faces, normals = extract_surface(volume, threshold)
+    if superseded is not None and superseded():
+        return False
+    save_mesh(project, verts, faces, normals)
+    return True
@@ -0,0 +1,323 @@
+import json
+import shutil
+import uuid
+
+import numpy as np
+from dicom.models import Project
+from dicom.services.points import POINT_DTYPE
+from dicom.services.volume import get_volume, volume_cache_dir
+from django.conf import settings
+from utils.files import write_atomic
+
+LEVEL_DTYPE = np.dtype(
+    [
+        ("code", "<u8"),
+        ("cell", "<u2", 3),
+        ("xyz", "<f4", 3),
+        ("value", "<u2"),
+        ("count", "<u4"),
+    ]
+)
+# memory per record while a level is built, counting the index, sort and
+# reduction temporaries next to the records themselves
+BUILD_RECORD_BYTES = 4 * LEVEL_DTYPE.itemsize
+
+
+def part1by2(values: np.ndarray) -> np.ndarray:
+    """Spread the low 21 bits of every value three bits apart."""
+    x = values.astype(np.uint64) & np.uint64(0x1FFFFF)
+    for shift, mask in (
+        (32, 0x1F00000000FFFF),
+        (16, 0x1F0000FF0000FF),
+        (8, 0x100F00F00F00F00F),
+        (4, 0x10C30C30C30C30C3),
+        (2, 0x1249249249249249),
+    ):
+        x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+    return x
+
+
+def morton(x, y, z) -> np.ndarray:
+    return (
+        part1by2(np.asarray(x))
+        | (part1by2(np.asarray(y)) << np.uint64(1))
+        | (part1by2(np.asarray(z)) << np.uint64(2))
+    )
+
+
+def octree_dir(project: Project):
+    return volume_cache_dir(project) / "octree"
+
+
+def block_side(depth: int) -> int:
+    """
+    Side of the aligned cubes the deepest level is built from, the largest
+    power of two whose records all fit DICOM_OCTREE_MEMORY_LIMIT.
+    """
+    voxels = settings.DICOM_OCTREE_MEMORY_LIMIT // BUILD_RECORD_BYTES
+    return 1 << min(max(int(np.log2(max(voxels, 1))) // 3, 0), depth)
+
+
+def chunk_records() -> int:
+    return max(settings.DICOM_OCTREE_MEMORY_LIMIT // BUILD_RECORD_BYTES, 16)
+
+
+def write_codes(level: np.ndarray, path):
+    """Contiguous copy of the keys, so searchsorted never touches the records."""
+    codes = np.lib.format.open_memmap(path, mode="w+", dtype="<u8", shape=level.shape)
+    step = chunk_records()
+    for start in range(0, len(level), step):
+        codes[start : start + step] = level["code"][start : start + step]  # noqa
+    codes.flush()
+
+
+def write_deepest_level(data: np.ndarray, threshold: float, depth: int, path):
+    """
+    The voxels above `threshold` as a Morton-sorted level file, built one
+    aligned cube at a time.
+
+    Every aligned cube holds one contiguous run of Morton codes, so writing
+    the cubes in Morton order of their corners leaves the file sorted and
+    only one cube's voxels are in memory at a time.
+    """
+    planes = max(settings.DICOM_OCTREE_MEMORY_LIMIT // max(data[0].size, 1), 1)
+    total = sum(
+        int(np.count_nonzero(data[start : start + planes] > threshold))  # noqa
+        for start in range(0, len(data), planes)
+    )
+    level = np.lib.format.open_memmap(
+        path, mode="w+", dtype=LEVEL_DTYPE, shape=(total,)
+    )
+
+    side = block_side(depth)
+    bz, by, bx = np.meshgrid(
+        *(np.arange(0, extent, side) for extent in data.shape), indexing="ij"
+    )
+    corners = np.stack([bx.ravel(), by.ravel(), bz.ravel()], axis=1)
+    corners = corners[np.argsort(morton(*corners.T), kind="stable")]
+    offset = 0
+    for x0, y0, z0 in corners:
+        block = data[z0 : z0 + side, y0 : y0 + side, x0 : x0 + side]  # noqa
+        z, y, x = np.nonzero(block > threshold)
+        if not len(z):
+            continue
+        part = np.empty(len(z), dtype=LEVEL_DTYPE)
+        part["cell"] = np.stack([x + x0, y + y0, z + z0], axis=1)
+        part["code"] = morton(*part["cell"].T)
+        part["xyz"] = part["cell"]
+        part["value"] = np.clip(block[z, y, x], 0, np.iinfo(np.uint16).max)
+        part["count"] = 1
+        part.sort(order="code")
+        level[offset : offset + len(part)] = part  # noqa
+        offset += len(part)
+    level.flush()
+    return level
+
+
+def coarsen(level: np.ndarray) -> np.ndarray:
+    """Parent cells of a sorted run of whole sibling groups."""
+    parent = level["code"] >> np.uint64(3)
+    starts = np.flatnonzero(np.r_[True, parent[1:] != parent[:-1]])
+    counts = np.add.reduceat(level["count"], starts)
+    coarser = np.empty(len(starts), dtype=LEVEL_DTYPE)
+    coarser["code"] = parent[starts]
+    coarser["cell"] = level["cell"][starts] >> 1
+    coarser["xyz"] = (
+        np.add.reduceat(level["xyz"] * level["count"][:, None], starts)
+        / counts[:, None]
+    )
+    coarser["value"] = np.maximum.reduceat(level["value"], starts)
+    coarser["count"] = counts
+    return coarser
+
+
+def write_coarser_level(level: np.ndarray, path):
+    """
+    The next coarser level of a sorted level file, streamed in chunks. A
+    chunk's last sibling group, at most eight records, waits for the next
+    chunk in case it continues there.
+    """
+    step = chunk_records()
+    parents = 0
+    previous = None
+    for start in range(0, len(level), step):
+        parent = level["code"][start : start + step] >> np.uint64(3)  # noqa
+        parents += int(np.count_nonzero(parent[1:] != parent[:-1])) + int(
+            parent[0] != previous
+        )
+        previous = parent[-1]
+    coarser = np.lib.format.open_memmap(
+        path, mode="w+", dtype=LEVEL_DTYPE, shape=(parents,)
+    )
+
+    offset = 0
+    carry = level[:0]
+    for start in range(0, len(level), step):
+        records = np.concatenate([carry, level[start : start + step]])  # noqa
+        if start + step < len(level):
+            parent = records["code"] >> np.uint64(3)
+            cut = int(np.searchsorted(parent, parent[-1]))
+            records, carry = records[:cut], records[cut:]
+        part = coarsen(records) if len(records) else coarser[:0]
+        coarser[offset : offset + len(part)] = part  # noqa
+        offset += len(part)
+    coarser.flush()
+    return coarser
+
+
+def build_octree(project: Project, threshold: float | None = None) -> dict:
+    """
+    Linear octree of the voxels above `threshold`, one Morton-sorted array
+    per depth next to the cached volume.
+
+    The deepest level holds the voxels themselves, every coarser cell keeps
+    the centroid, maximum value and voxel count of its children. Levels are
+    built and written in pieces of DICOM_OCTREE_MEMORY_LIMIT, however many
+    voxels pass the threshold.
+
+    Every build writes a directory of its own and then swaps meta.json over
+    to it, so readers that have the previous arrays memory-mapped keep
+    reading complete files.
+    """
+    if threshold is None:
+        threshold = settings.DICOM_OCTREE_THRESHOLD
+    volume = get_volume(project, rescale=False)
+    depth = max(int(np.ceil(np.log2(max(volume.data.shape)))), 0)
+
+    version = uuid.uuid4().hex
+    directory = octree_dir(project) / version
+    directory.mkdir(parents=True)
+    level = write_deepest_level(
+        volume.data, threshold, depth, directory / f"level_{depth}.npy"
+    )
+    for current in range(depth, -1, -1):
+        write_codes(level, directory / f"codes_{current}.npy")
+        if current:
+            level = write_coarser_level(level, directory / f"level_{current - 1}.npy")
+    del level
+
+    meta = {
+        "version": version,
+        "depth": depth,
+        "threshold": threshold,
+        "shape": [int(x) for x in volume.data.shape],
+    }
+    write_atomic(octree_dir(project) / "meta.json", json.dumps(meta).encode())
+    # mapped files of older versions stay readable until they are unmapped
+    for previous in octree_dir(project).iterdir():
+        if previous.is_dir() and previous.name != version:
+            shutil.rmtree(previous, ignore_errors=True)
+    return meta
+
+
+def read_octree(project: Project) -> dict | None:
+    try:
+        with open(octree_dir(project) / "meta.json") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # octrees written in place before versioned directories get rebuilt
+    return meta if "version" in meta else None
+
+
+def load_octree(project: Project) -> dict:
+    return read_octree(project) or build_octree(project)
+
+
+def cell_ranges(lo, hi, depth: int, max_ranges: int) -> list[tuple[int, int]]:
+    """
+    Morton code ranges at `depth` covering the inclusive cell box [lo, hi].
+
+    Cells fully inside the box become one range each, cells on its border are
+    split further until `max_ranges` is reached, then kept whole.
+    """
+    lo, hi = np.asarray(lo), np.asarray(hi)
+    ranges = []
+    cells = [np.zeros(3, dtype=np.int64)]
+    for level in range(depth + 1):
+        shift = depth - level
+        partial = []
+        for cell in cells:
+            first, last = cell << shift, ((cell + 1) << shift) - 1
+            if (last < lo).any() or (first > hi).any():
+                continue
+            if ((first >= lo) & (last <= hi)).all() or level == depth:
+                ranges.append((first, shift))
+            else:
+                partial.append(cell)
+        if not partial:
+            break
+        if len(ranges) + 8 * len(partial) > max_ranges:
+            ranges.extend((cell << shift, shift) for cell in partial)
+            break
+        cells = [
+            (cell << 1) + np.array([dx, dy, dz])
+            for cell in partial
+            for dz in (0, 1)
+            for dy in (0, 1)
+            for dx in (0, 1)
+        ]
+
+    spans = sorted(
+        (int(code), int(code) + (1 << (3 * shift)) - 1)
+        for code, shift in ((morton(*first), shift) for first, shift in ranges)
+    )
+    merged = []
+    for start, stop in spans:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def query_octree(
+    project: Project,
+    lo: tuple[int, int, int],
+    hi: tuple[int, int, int],
+    depth: int,
+    limit: int,
+) -> tuple[np.ndarray, bool] | None:
+    """
+    Points of one octree depth inside the voxel box [lo, hi) as (x, y, z).
+
+    Returns at most `limit` points and whether the box held more, in which
+    case a coarser depth or a smaller box should be asked for, or None if
+    the octree is not built.
+    """
+    meta = read_octree(project)
+    if meta is None:
+        return None
+    depth = min(max(depth, 0), meta["depth"])
+    directory = octree_dir(project) / meta["version"]
+    try:
+        level = np.load(directory / f"level_{depth}.npy", mmap_mode="r")
+        codes = np.load(directory / f"codes_{depth}.npy", mmap_mode="r")
+    except (OSError, ValueError):
+        # replaced by a newer build since meta.json was read
+        return None
+
+    shift = meta["depth"] - depth
+    lo = np.maximum(np.asarray(lo), 0) >> shift
+    hi = (np.maximum(np.asarray(hi), 1) - 1) >> shift
+    candidates = []
+    found = 0
+    for start, stop in cell_ranges(lo, hi, depth, settings.DICOM_OCTREE_MAX_RANGES):
+        first, last = np.searchsorted(codes, np.array([start, stop + 1], "<u8"))
+        # read no more records than could still be returned, a range holding
+        # the whole volume costs the same as one holding `limit` points
+        while first < last and found <= limit:
+            end = min(last, first + limit + 1 - found)
+            chunk = level[first:end]
+            chunk = chunk[((chunk["cell"] >= lo) & (chunk["cell"] <= hi)).all(axis=1)]
+            candidates.append(chunk)
+            found += len(chunk)
+            first = end
+        if found > limit:
+            break
+
+    selected = np.concatenate(candidates) if candidates else level[:0]
+    points = np.empty(min(len(selected), limit), dtype=POINT_DTYPE)
+    points["xyz"] = selected["xyz"][:limit]
+    points["value"] = selected["value"][:limit]
+    return points, found > limit
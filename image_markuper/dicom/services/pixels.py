@@ -0,0 +1,127 @@
+import gzip
+import json
+import struct
+from collections.abc import Iterator
+from pathlib import Path
+
+import numpy as np
+import pydicom
+import zstandard
+from dicom.models import Dicom
+from dicom.services.decode import rescale_params
+from dicom.services.headers import slice_spacing
+from django.conf import settings
+from utils.files import write_atomic
+
+PIXEL_DTYPE = np.dtype("<i2")
+
+# encoding name to compressor of one slice, every slice is its own frame
+PIXEL_ENCODINGS = {
+    "raw": lambda data: data,
+    "gzip": lambda data: gzip.compress(data, compresslevel=6, mtime=0),
+    "zstd": lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+}
+
+
+def pixel_dir(key: str) -> Path:
+    return Path(settings.DICOM_PIXEL_CACHE_ROOT) / key[:2] / key[2:4]
+
+
+def decode_int16(path: str) -> tuple[np.ndarray, float, float]:
+    """
+    Stored pixels of one slice as int16 with the modality LUT still to apply.
+
+    Pixels that do not fit int16 are rescaled to modality units here and
+    clipped, their LUT becomes the identity.
+    """
+    dataset = pydicom.dcmread(path)
+    pixels = dataset.pixel_array
+    slope, intercept = rescale_params(dataset)
+    limits = np.iinfo(PIXEL_DTYPE)
+    if np.can_cast(pixels.dtype, PIXEL_DTYPE) or (
+        pixels.min() >= limits.min and pixels.max() <= limits.max
+    ):
+        return pixels.astype(PIXEL_DTYPE), slope, intercept
+    modality = pixels * np.float32(slope) + np.float32(intercept)
+    return np.clip(np.rint(modality), limits.min, limits.max).astype(PIXEL_DTYPE), 1, 0
+
+
+def cached_slice(dicom: Dicom, encoding: str) -> tuple[dict, Path]:
+    """
+    Metadata and encoded frame of one decoded slice from the pixel cache,
+    decoding and encoding it first where they are missing.
+    """
+    key = dicom.content_key
+    directory = pixel_dir(key)
+    frame = directory / f"{key}.{encoding}"
+    try:
+        with open(directory / f"{key}.json") as f:
+            meta = json.load(f)
+        if not frame.exists():
+            raw = (directory / f"{key}.raw").read_bytes()
+            write_atomic(frame, PIXEL_ENCODINGS[encoding](raw))
+    except (OSError, ValueError):
+        # missing, or partly removed by hand or by an interrupted write
+        pixels, slope, intercept = decode_int16(dicom.file.path)
+        raw = pixels.tobytes()
+        write_atomic(directory / f"{key}.raw", raw)
+        meta = {"shape": list(pixels.shape), "rescale": [slope, intercept]}
+        write_atomic(directory / f"{key}.json", json.dumps(meta).encode())
+        if not frame.exists():
+            write_atomic(frame, PIXEL_ENCODINGS[encoding](raw))
+    return meta, frame
+
+
+def delete_pixels(content_key: str):
+    """Drop the decoded slice of one content and every encoding of it."""
+    for path in pixel_dir(content_key).glob(f"{content_key}.*"):
+        path.unlink(missing_ok=True)
+
+
+def pixel_payload(dicoms: list[Dicom], encoding: str) -> tuple[int, Iterator[bytes]]:
+    """
+    Length and chunks of a pixel payload of consecutive slices.
+
+    The payload is a little-endian uint32 header length, the JSON header
+    and then one `encoding` frame of int16 pixels per slice, whose sizes
+    the header lists.
+    """
+    slices = [(x, *cached_slice(x, encoding)) for x in dicoms]
+    shape = slices[0][1]["shape"]
+    for dicom, meta, _ in slices:
+        if meta["shape"] != shape:
+            raise ValueError(f"slice {dicom.slug} does not match shape {shape}")
+
+    pixel_spacing = dicoms[0].pixel_spacing or [None, None]
+    header = json.dumps(
+        {
+            "dtype": PIXEL_DTYPE.str,
+            "encoding": encoding,
+            "shape": [len(slices), *shape],
+            "spacing": [
+                slice_spacing(
+                    [x.slice_position for x in dicoms], dicoms[0].slice_thickness
+                ),
+                *pixel_spacing,
+            ],
+            "slices": [
+                {
+                    "slug": dicom.slug,
+                    "position": dicom.slice_position,
+                    "rescale": meta["rescale"],
+                    "size": frame.stat().st_size,
+                }
+                for dicom, meta, frame in slices
+            ],
+        },
+        separators=(",", ":"),
+    ).encode()
+    length = 4 + len(header) + sum(frame.stat().st_size for _, _, frame in slices)
+
+    def chunks():
+        yield struct.pack("<I", len(header))
+        yield header
+        for _, _, frame in slices:
+            yield frame.read_bytes()
+
+    return length, chunks()
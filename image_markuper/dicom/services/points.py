@@ -0,0 +1,55 @@
+import numpy as np
+from dicom.services.volume import Volume
+
+POINT_DTYPE = np.dtype([("xyz", "<f4", 3), ("value", "<u2")])
+
+
+def generate_3d_point_cloud(
+    volume: Volume,
+    stride: int = 10,
+    threshold: float = 240,
+    value_range: tuple[float, float] | None = None,
+) -> np.ndarray:
+    """
+    Voxels of every `stride`-th slice, row and column of the stored
+    `volume` above `threshold`.
+
+    Thresholds and values are stored pixel values; coordinates are voxel
+    indices as (column, row, slice), the same frame as the project meshes.
+    """
+    sampled = volume.data[::stride, ::stride, ::stride]
+    mask = sampled > threshold
+    if value_range is not None:
+        mask &= (sampled >= value_range[0]) & (sampled <= value_range[1])
+    z, y, x = np.nonzero(mask)
+
+    points = np.empty(len(z), dtype=POINT_DTYPE)
+    points["xyz"] = np.stack([x, y, z], axis=1) * stride
+    points["value"] = np.clip(sampled[z, y, x], 0, np.iinfo(np.uint16).max)
+    return points
+
+
+def ply_header(count: int) -> bytes:
+    return "\n".join(
+        [
+            "ply",
+            "format binary_little_endian 1.0",
+            f"element vertex {count}",
+            "property float x",
+            "property float y",
+            "property float z",
+            "property ushort value",
+            "end_header\n",
+        ]
+    ).encode()
+
+
+def point_cloud_stream(points: np.ndarray, encoding: str = "bin", chunk: int = 65536):
+    """
+    Yield the points as packed little-endian records, 3 float32 and an uint16
+    each, prefixed with a PLY header for the "ply" encoding.
+    """
+    if encoding == "ply":
+        yield ply_header(len(points))
+    for start in range(0, len(points), chunk):
+        yield points[start : start + chunk].tobytes()  # noqa
@@ -0,0 +1,64 @@
+from urllib.parse import urlencode
+
+from dicom import tasks
+from dicom.models import Dicom, Project
+from dicom.services.render import render_slice
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from pydicom.errors import InvalidDicomError
+
+PREVIEW_ENCODING = "webp"
+
+
+def preview_sizes() -> list[int | None]:
+    """Preview sides, None being the slice at full size."""
+    return [*settings.DICOM_PREVIEW_SIZES, None]
+
+
+def preview_url(dicom: Dicom, size: int | None) -> str:
+    """Render endpoint of one preview, its default window is what gets cached."""
+    query = {"encoding": PREVIEW_ENCODING}
+    if size is not None:
+        query["size"] = size
+    return f"{reverse('render_dicom', kwargs={'slug': dicom.slug})}?{urlencode(query)}"
+
+
+def preview_urls(dicom: Dicom) -> dict[str, str]:
+    return {str(size or "full"): preview_url(dicom, size) for size in preview_sizes()}
+
+
+def schedule_previews(dicoms: list[Dicom]):
+    """Queue previews of new dicoms, DICOM_PREVIEW_BATCH per task."""
+    pks = [x.pk for x in dicoms]
+    batch = settings.DICOM_PREVIEW_BATCH
+    for start in range(0, len(pks), batch):
+        chunk = pks[start : start + batch]  # noqa
+        transaction.on_commit(lambda chunk=chunk: tasks.process_previews.delay(chunk))
+
+
+def update_project_thumbnail(project_id: int):
+    """Point the project at its middle slice in stack order."""
+    project = Project(pk=project_id)
+    count = project.files.count()
+    middle = project.slices.values_list("pk", flat=True)[count // 2] if count else None
+    Project.objects.filter(pk=project_id).update(thumbnail_id=middle)
+
+
+def generate_previews(dicoms):
+    """
+    Render every preview size of `dicoms` into the render cache, then pick
+    the thumbnails of their projects. Unreadable slices are left to render
+    on demand, where they fail visibly.
+    """
+    projects = set()
+    for dicom in dicoms:
+        for size in preview_sizes():
+            try:
+                render_slice(dicom, None, size, PREVIEW_ENCODING)
+            except (InvalidDicomError, OSError, ValueError, AttributeError):
+                break
+        if dicom.project_id:
+            projects.add(dicom.project_id)
+    for project_id in projects:
+        update_project_thumbnail(project_id)
@@ -0,0 +1,126 @@
+import time
+from functools import lru_cache
+
+import redis
+from dicom import tasks
+from dicom.models import MeshVariant, Project
+from dicom.services.mesh import generate_mesh_pyramid
+from dicom.services.octree import build_octree, load_octree
+from dicom.services.volume import get_volume, invalidate_volume
+from django.conf import settings
+from django.db import transaction
+
+
+@lru_cache(maxsize=None)
+def redis_client() -> redis.Redis:
+    return redis.Redis.from_url(settings.DICOM_REBUILD_REDIS_URL)
+
+
+def rebuild_key(project_id: int, name: str) -> str:
+    return f"dicom:project:{project_id}:rebuild:{name}"
+
+
+def enqueue_rebuild(project_id: int, countdown: float):
+    tasks.process_project.apply_async(kwargs={"pk": project_id}, countdown=countdown)
+
+
+def schedule_project_rebuild(project_id: int):
+    """
+    Bump the project's version and queue a rebuild unless one is queued
+    already, so a burst of changes ends in a single build.
+    """
+    client = redis_client()
+    with client.pipeline() as pipe:
+        pipe.incr(rebuild_key(project_id, "version"))
+        pipe.set(rebuild_key(project_id, "changed"), time.time())
+        pipe.execute()
+    delay = settings.DICOM_REBUILD_DELAY
+    if client.set(
+        rebuild_key(project_id, "scheduled"),
+        1,
+        nx=True,
+        ex=delay + 2 * settings.CELERY_TASK_TIME_LIMIT,
+    ):
+        transaction.on_commit(lambda: enqueue_rebuild(project_id, delay))
+
+
+def schedule_volume_build(project_id: int):
+    """
+    Queue a build of the project's volume and octree for requests that
+    found them missing, unless one is queued already.
+    """
+    if redis_client().set(
+        rebuild_key(project_id, "volume"),
+        1,
+        nx=True,
+        ex=settings.CELERY_TASK_TIME_LIMIT,
+    ):
+        transaction.on_commit(lambda: tasks.process_volume.delay(pk=project_id))
+
+
+def build_volume_cache(project_id: int):
+    try:
+        project = Project.objects.filter(pk=project_id).first()
+        if project is not None and project.files.exists():
+            get_volume(project, rescale=False)
+            load_octree(project)
+    finally:
+        redis_client().delete(rebuild_key(project_id, "volume"))
+
+
+def drop_project_caches(project_id: int):
+    invalidate_volume(Project(pk=project_id))
+    MeshVariant.objects.filter(project_id=project_id).delete()
+    schedule_project_rebuild(project_id)
+
+
+def generate_3d_model(project: Project, thr=800, superseded=None) -> bool:
+    # thr is in modality units, HU for CT
+    return generate_mesh_pyramid(
+        project, get_volume(project, rescale=False), thr, superseded
+    )
+
+
+def rebuild_project(project_id: int) -> bool:
+    """
+    Rebuild the mesh pyramid and octree once changes have been quiet for
+    DICOM_REBUILD_DELAY seconds, one build per project at a time.
+
+    A build that sees the version move on stops early, the change that
+    moved it has queued the next build already.
+    """
+    client = redis_client()
+    delay = settings.DICOM_REBUILD_DELAY
+    changed = float(client.get(rebuild_key(project_id, "changed")) or 0)
+    if time.time() - changed < delay:
+        enqueue_rebuild(project_id, delay - (time.time() - changed))
+        return False
+    lock = client.lock(
+        rebuild_key(project_id, "lock"), timeout=settings.CELERY_TASK_TIME_LIMIT
+    )
+    if not lock.acquire(blocking=False):
+        enqueue_rebuild(project_id, delay)
+        return False
+
+    try:
+        # changes from here on queue a build of their own
+        client.delete(rebuild_key(project_id, "scheduled"))
+        version = client.get(rebuild_key(project_id, "version"))
+
+        def superseded() -> bool:
+            return client.get(rebuild_key(project_id, "version")) != version
+
+        project = Project.objects.filter(pk=project_id).first()
+        # marching cubes needs at least two slices
+        if project is None or project.files.count() < 2:
+            return False
+        if not generate_3d_model(project, superseded=superseded) or superseded():
+            return False
+        build_octree(project)
+        return True
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            # outlived its timeout, another build may hold it by now
+            pass
@@ -0,0 +1,133 @@
+import io
+from pathlib import Path
+
+import numpy as np
+import pydicom
+from dicom.models import Dicom
+from dicom.services.decode import rescale_params
+from django.conf import settings
+from PIL import Image
+from utils.files import write_atomic
+
+# (center, width) in HU
+WINDOW_PRESETS = {
+    "lung": (-600, 1500),
+    "mediastinum": (50, 350),
+    "abdomen": (40, 400),
+    "bone": (400, 1800),
+    "brain": (40, 80),
+}
+
+RENDER_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+
+def render_key(
+    dicom: Dicom, window: tuple[int, int] | None, size: int | None, encoding: str
+) -> str:
+    center, width = window if window is not None else ("auto", "auto")
+    return f"{dicom.content_key}_{center}_{width}_{size or 'full'}.{encoding}"
+
+
+def render_path(key: str) -> Path:
+    return Path(settings.DICOM_RENDER_CACHE_ROOT) / key[:2] / key[2:4] / key
+
+
+def is_cached_render(window: tuple[int, int] | None, size: int | None) -> bool:
+    """
+    Renders kept on disk: the default window or a preset, at full size or
+    a preview size. Any other window or size is rendered on every request,
+    so clients cannot grow the cache without bound.
+    """
+    return (window is None or window in WINDOW_PRESETS.values()) and (
+        size is None or size in settings.DICOM_PREVIEW_SIZES
+    )
+
+
+def delete_renders(content_key: str):
+    """Drop every cached render of one content."""
+    directory = render_path(content_key).parent
+    for path in directory.glob(f"{content_key}_*"):
+        path.unlink(missing_ok=True)
+
+
+def header_window(dataset) -> tuple[float, float] | None:
+    center, width = dataset.get("WindowCenter"), dataset.get("WindowWidth")
+    if center is None or width is None:
+        return None
+    # multi-valued windows are alternatives, the first is the default
+    if isinstance(center, pydicom.multival.MultiValue):
+        center = center[0]
+    if isinstance(width, pydicom.multival.MultiValue):
+        width = width[0]
+    return float(center), float(width)
+
+
+def apply_window(pixels: np.ndarray, center: float, width: float) -> np.ndarray:
+    """Linear VOI LUT of PS3.3 C.11.2.1.2 down to 8 bits."""
+    scaled = (pixels - (center - 0.5)) / max(width - 1, 1) + 0.5
+    np.clip(scaled, 0, 1, out=scaled)
+    scaled *= 255
+    return scaled.astype(np.uint8)
+
+
+def render_image(
+    path: str, window: tuple[int, int] | None, size: int | None, encoding: str
+) -> bytes:
+    """
+    Decode one slice, apply its modality LUT and `window`, or the header's
+    default window, scale it to fit `size` and encode it.
+    """
+    dataset = pydicom.dcmread(path)
+    pixels = dataset.pixel_array.astype(np.float32)
+    slope, intercept = rescale_params(dataset)
+    if slope != 1:
+        pixels *= slope
+    if intercept != 0:
+        pixels += intercept
+
+    if window is None:
+        window = header_window(dataset)
+    if window is None:
+        low, high = float(pixels.min()), float(pixels.max())
+        window = (low + high) / 2, high - low + 1
+    image = apply_window(pixels, *window)
+    if dataset.get("PhotometricInterpretation") == "MONOCHROME1":
+        np.subtract(255, image, out=image)
+
+    image = Image.fromarray(image)
+    if size is not None and max(image.size) != size:
+        scale = size / max(image.size)
+        image = image.resize(
+            (max(round(image.width * scale), 1), max(round(image.height * scale), 1)),
+            Image.LANCZOS,
+        )
+    out = io.BytesIO()
+    image.save(out, format=RENDER_FORMATS[encoding][0])
+    return out.getvalue()
+
+
+def render_slice(
+    dicom: Dicom,
+    window: tuple[int, int] | None = None,
+    size: int | None = None,
+    encoding: str = "png",
+) -> bytes:
+    """
+    Rendered slice, from the render cache where `is_cached_render` keeps it,
+    rendering and caching it first if it is not there yet.
+
+    Renders depend on the content and parameters only, so they are never
+    stale and `render_key` doubles as a strong ETag.
+    """
+    if not is_cached_render(window, size):
+        return render_image(dicom.file.path, window, size, encoding)
+    path = render_path(render_key(dicom, window, size, encoding))
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        content = render_image(dicom.file.path, window, size, encoding)
+        write_atomic(path, content)
+        return content
@@ -0,0 +1,70 @@
+"""
+Serialized shapes and layers of a dicom, cached under a per-dicom version.
+
+Every write drops the version once its transaction commits, the next read
+starts a new one and entries of old versions are left to expire.
+"""
+from collections.abc import Callable
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+SHAPE_CACHE_STATS = ("hits", "misses", "invalidations")
+
+
+def version_key(dicom_id: int) -> str:
+    return f"dicom:shapes:{dicom_id}:version"
+
+
+def stat_key(name: str) -> str:
+    return f"dicom:shapes:stats:{name}"
+
+
+def count(name: str):
+    key = stat_key(name)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted between add and incr, losing one count is fine
+        pass
+
+
+def shapes_version(dicom_id: int) -> str:
+    # random instead of a counter, an evicted counter would restart at
+    # versions whose entries may still be around
+    cache.add(version_key(dicom_id), uuid4().hex, timeout=None)
+    return cache.get(version_key(dicom_id)) or ""
+
+
+def cached_shapes(dicom_id: int, build: Callable[[], dict]) -> dict:
+    version = shapes_version(dicom_id)
+    key = f"dicom:shapes:{dicom_id}:{version}"
+    payload = cache.get(key) if version else None
+    if payload is not None:
+        count("hits")
+        return payload
+    count("misses")
+    payload = build()
+    if version:
+        cache.set(key, payload, timeout=settings.DICOM_SHAPES_CACHE_TIMEOUT)
+    return payload
+
+
+def invalidate_shapes(dicom_id: int):
+    """Drop the cached shapes of a dicom once the current transaction commits."""
+
+    def invalidate():
+        cache.delete(version_key(dicom_id))
+        count("invalidations")
+
+    transaction.on_commit(invalidate)
+
+
+def shape_cache_stats() -> dict:
+    stats = {name: cache.get(stat_key(name)) or 0 for name in SHAPE_CACHE_STATS}
+    reads = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / reads if reads else None
+    return stats
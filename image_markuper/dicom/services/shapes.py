@@ -0,0 +1,139 @@
+from dicom.models import BaseShape, Circle, Coordinate, Dicom, FreeHand, Roi, Ruler
+from dicom.models.shapes import pack_coordinates
+from dicom.services.shape_cache import invalidate_shapes
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, router, transaction
+from django.http import Http404
+
+SHAPE_MODELS = {
+    "circle": Circle,
+    "roi": Roi,
+    "free_hand": FreeHand,
+    "ruler": Ruler,
+}
+
+
+def resolve_layers(dicom: Dicom, slugs) -> dict[str, int]:
+    """Layer ids of `dicom` by slug in one query, "" maps to the root layer."""
+    layers = {}
+    for pk, slug, parent_id in dicom.layers.values_list("pk", "slug", "parent_id"):
+        layers[slug] = pk
+        if parent_id is None:
+            layers.setdefault("", pk)
+    missing = set(slugs) - set(layers)
+    if missing:
+        raise Http404(f"no layer {', '.join(sorted(missing))} on this dicom")
+    return layers
+
+
+def delete_shapes(dicom: Dicom):
+    """
+    Delete every shape of `dicom` with one DELETE per table.
+
+    QuerySet.delete goes through the collector, which loads the subclass
+    rows and cascades per shape. Shapes have no signals or files, so the
+    legacy coordinates and the subclass rows are deleted by their parent
+    ids first, then the parents by layer.
+    """
+    connection = connections[router.db_for_write(BaseShape)]
+    quote = connection.ops.quote_name
+    shapes, shape_params = (
+        BaseShape.objects.non_polymorphic()
+        .filter(layer_fk__dicom=dicom)
+        .order_by()
+        .values("pk")
+        .query.sql_with_params()
+    )
+    layers, layer_params = dicom.layers.order_by().values("pk").query.sql_with_params()
+    tables = [
+        (Coordinate, Coordinate._meta.get_field("shape").column, shapes, shape_params),
+        *(
+            (model, model._meta.pk.column, shapes, shape_params)
+            for model in SHAPE_MODELS.values()
+        ),
+        (BaseShape, BaseShape._meta.get_field("layer_fk").column, layers, layer_params),
+    ]
+    with connection.cursor() as cursor:
+        for model, column, subquery, params in tables:
+            cursor.execute(
+                f"DELETE FROM {quote(model._meta.db_table)} "
+                f"WHERE {quote(column)} IN ({subquery})",
+                params,
+            )
+
+
+def insert_children(model, parents: list[BaseShape], values: list[dict]):
+    """
+    Insert the subclass rows of already saved parents, one multi-row INSERT
+    per batch.
+
+    bulk_create refuses multi-table models, so the statement is built here
+    from the child table's own fields rather than through the manager's
+    private insert.
+    """
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    fields = model._meta.local_concrete_fields
+    objs = [
+        model(baseshape_ptr_id=parent.pk, **extra)
+        for parent, extra in zip(parents, values)
+    ]
+    rows = [
+        [
+            field.get_db_prep_save(getattr(obj, field.attname), connection)
+            for field in fields
+        ]
+        for obj in objs
+    ]
+    columns = ", ".join(quote(field.column) for field in fields)
+    placeholder = f"({', '.join(['%s'] * len(fields))})"
+    batch = max(connection.ops.bulk_batch_size(fields, objs), 1)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch):
+            chunk = rows[start : start + batch]  # noqa
+            cursor.execute(
+                f"INSERT INTO {quote(model._meta.db_table)} ({columns}) "
+                f"VALUES {', '.join([placeholder] * len(chunk))}",
+                [value for row in chunk for value in row],
+            )
+
+
+def replace_shapes(dicom: Dicom, shapes: list[dict]):
+    """
+    Swap every shape of `dicom` for `shapes` in one transaction.
+
+    The query count does not depend on the number of shapes or points:
+    one layer lookup, one DELETE per shape table, one insert for the
+    parents with their packed coordinates and one per shape type present,
+    each insert split only where the backend limits its parameters.
+    """
+    layers = resolve_layers(dicom, {x.get("layer") or "" for x in shapes})
+    with transaction.atomic():
+        delete_shapes(dicom)
+
+        parents = [
+            BaseShape(
+                layer_fk_id=layers[shape.get("layer") or ""],
+                points=pack_coordinates(shape["coordinates"]),
+                polymorphic_ctype=ContentType.objects.get_for_model(
+                    SHAPE_MODELS[shape["type"]], for_concrete_model=False
+                ),
+            )
+            for shape in shapes
+        ]
+        BaseShape.objects.bulk_create(parents)
+
+        invalidate_shapes(dicom.pk)
+
+        for shape_type, model in SHAPE_MODELS.items():
+            selected = [i for i, x in enumerate(shapes) if x["type"] == shape_type]
+            if not selected:
+                continue
+            insert_children(
+                model,
+                [parents[i] for i in selected],
+                [
+                    {"radius": shapes[i]["radius"]} if model is Circle else {}
+                    for i in selected
+                ],
+            )
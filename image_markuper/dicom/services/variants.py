@@ -0,0 +1,123 @@
+import dataclasses
+import hashlib
+import json
+from datetime import timedelta
+
+from dicom import tasks
+from dicom.models import MeshVariant, Project
+from dicom.services.mesh import MESH_FORMATS, extract_surface
+from dicom.services.volume import get_volume
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+
+def variant_key(project: Project, threshold: float, step_size: int, roi) -> str:
+    params = {
+        "project": project.pk,
+        "threshold": float(threshold),
+        "step_size": int(step_size),
+        "roi": roi,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def request_mesh_variant(
+    project: Project, threshold: float, step_size: int = 1, roi: dict | None = None
+) -> tuple[MeshVariant, bool]:
+    """
+    Return the variant for these parameters and whether it is ready.
+
+    A missing or failed variant is queued for building, one that is already
+    pending is returned as is, so identical requests share one build. A
+    variant pending for longer than DICOM_MESH_VARIANT_TIMEOUT lost its task
+    to a crashed or killed worker and is queued again.
+    """
+    key = variant_key(project, threshold, step_size, roi)
+    try:
+        with transaction.atomic():
+            variant, created = MeshVariant.objects.get_or_create(
+                key=key,
+                defaults={
+                    "project": project,
+                    "threshold": threshold,
+                    "step_size": step_size,
+                    "roi": roi,
+                },
+            )
+    except IntegrityError:
+        variant, created = MeshVariant.objects.get(key=key), False
+
+    if variant.status == MeshVariant.Status.ready:
+        MeshVariant.objects.filter(pk=variant.pk).update(last_used=timezone.now())
+        return variant, True
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.DICOM_MESH_VARIANT_TIMEOUT)
+    if variant.status == MeshVariant.Status.failed or variant.updated < stale:
+        # whoever moves it on from the state read here queues the build
+        updated = MeshVariant.objects.filter(
+            pk=variant.pk, status=variant.status, updated=variant.updated
+        ).update(status=MeshVariant.Status.pending, updated=now)
+        variant.status, variant.updated = MeshVariant.Status.pending, now
+        created = bool(updated)
+    if created:
+        transaction.on_commit(lambda: tasks.process_mesh_variant.delay(pk=variant.pk))
+    return variant, False
+
+
+def generate_mesh_variant(variant: MeshVariant):
+    try:
+        volume = get_volume(variant.project, rescale=False)
+        origin = (0, 0, 0)
+        if variant.roi:
+            (x0, x1), (y0, y1), (z0, z1) = (variant.roi[x] for x in "xyz")
+            volume = dataclasses.replace(
+                volume.slab(z0, z1), data=volume.data[z0:z1, y0:y1, x0:x1]
+            )
+            origin = (x0, y0, z0)
+        verts, faces, normals = extract_surface(
+            volume, variant.threshold, variant.step_size
+        )
+        verts = verts + origin
+    except Exception:
+        MeshVariant.objects.filter(pk=variant.pk).update(
+            status=MeshVariant.Status.failed, updated=timezone.now()
+        )
+        raise
+
+    extension = settings.DICOM_MESH_FORMATS[0]
+    content = MESH_FORMATS[extension](verts, faces, normals)
+    variant.file.save(
+        f"{variant.key[:16]}.{extension}", ContentFile(content), save=False
+    )
+    # an update, not a save: a row dropped with the project's caches during
+    # the build must stay dropped instead of coming back with stale geometry
+    updated = MeshVariant.objects.filter(pk=variant.pk).update(
+        file=variant.file.name,
+        triangles=len(faces),
+        size=len(content),
+        status=MeshVariant.Status.ready,
+        updated=timezone.now(),
+        last_used=timezone.now(),
+    )
+    if not updated:
+        variant.file.delete(save=False)
+        return
+    evict_mesh_variants(keep=variant)
+
+
+def evict_mesh_variants(keep: MeshVariant | None = None):
+    """Drop least recently used variants until they fit DICOM_MESH_CACHE_BYTES."""
+    ready = MeshVariant.objects.filter(status=MeshVariant.Status.ready)
+    total = ready.aggregate(total=Sum("size"))["total"] or 0
+    if total <= settings.DICOM_MESH_CACHE_BYTES:
+        return
+    if keep is not None:
+        ready = ready.exclude(pk=keep.pk)
+    for variant in ready.order_by("last_used").only("pk", "file", "size"):
+        variant.delete()
+        total -= variant.size
+        if total <= settings.DICOM_MESH_CACHE_BYTES:
+            break
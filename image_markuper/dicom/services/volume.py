@@ -0,0 +1,222 @@
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+from dicom.models import Dicom, Project
+from dicom.services.decode import decode_slices, rescale_params
+from dicom.services.headers import (
+    header_dataset,
+    is_indexed,
+    read_header,
+    slice_position,
+    slice_spacing,
+)
+from django.conf import settings
+from pydicom.dataset import Dataset
+from pydicom.pixel_data_handlers.util import pixel_dtype
+from utils.files import temporary_path, write_atomic
+
+
+class Slice(NamedTuple):
+    pk: int
+    path: str
+    header: Dataset
+
+
+@dataclass
+class Volume:
+    """CT volume laid out as (slice, row, column), one contiguous array."""
+
+    data: np.ndarray
+    spacing: tuple[float, float, float]
+    slices: list[int]
+    # per-slice modality LUT still to be applied to `data`
+    slopes: np.ndarray
+    intercepts: np.ndarray
+
+    def slab(self, start: int, stop: int) -> "Volume":
+        return Volume(
+            data=self.data[start:stop],
+            spacing=self.spacing,
+            slices=self.slices[start:stop],
+            slopes=self.slopes[start:stop],
+            intercepts=self.intercepts[start:stop],
+        )
+
+    def modality(self) -> "Volume":
+        """Float32 volume in modality units, copying only if a LUT is pending."""
+        if (
+            self.data.dtype == np.float32
+            and not (self.slopes != 1).any()
+            and not self.intercepts.any()
+        ):
+            return self
+        data = self.data.astype(np.float32)
+        data *= self.slopes[:, None, None].astype(np.float32)
+        data += self.intercepts[:, None, None].astype(np.float32)
+        return Volume(
+            data=data,
+            spacing=self.spacing,
+            slices=self.slices,
+            slopes=np.ones_like(self.slopes),
+            intercepts=np.zeros_like(self.intercepts),
+        )
+
+
+def sort_slices(files: list[Dicom]) -> list[Slice]:
+    """Read headers only and order slices by patient position, then InstanceNumber."""
+    slices = [Slice(x.pk, x.file.path, read_header(x.file.path)) for x in files]
+
+    def key(item):
+        index, sl = item
+        position = slice_position(sl.header)
+        if position is not None:
+            return 0, position, index
+        return 1, int(sl.header.get("InstanceNumber") or 0), index
+
+    return [sl for _, sl in sorted(enumerate(slices), key=key)]
+
+
+def project_slices(project: Project) -> list[Slice]:
+    """
+    Slices in stack order with their headers from the index, in one query.
+    Files ingested before the index are parsed and sorted as before.
+    """
+    files = list(project.slices)
+    if not all(is_indexed(x) for x in files):
+        return sort_slices(files)
+    return [Slice(x.pk, x.file.path, header_dataset(x)) for x in files]
+
+
+def volume_dtype(slices: list[Slice], rescale: bool) -> np.dtype:
+    if rescale:
+        return np.dtype(np.float32)
+    return np.result_type(*{pixel_dtype(x.header) for x in slices})
+
+
+def build_volume(
+    slices: list[Slice], rescale: bool = True, out: np.ndarray | None = None
+) -> Volume:
+    """
+    Decode the already ordered slices into one preallocated volume.
+
+    With `rescale` the volume is float32 in modality units (HU for CT),
+    otherwise it keeps the stored pixel dtype.
+    """
+    if not slices:
+        raise ValueError("no slices to build a volume from")
+    first = slices[0].header
+    shape = (len(slices), int(first.Rows), int(first.Columns))
+    for sl in slices:
+        if (int(sl.header.Rows), int(sl.header.Columns)) != shape[1:]:
+            raise ValueError(f"slice {sl.pk} does not match volume shape {shape}")
+
+    if out is None:
+        out = np.empty(shape, dtype=volume_dtype(slices, rescale))
+    decode_slices(
+        [x.path for x in slices],
+        out,
+        rescale,
+        workers=settings.DICOM_DECODE_WORKERS,
+        chunk_size=settings.DICOM_DECODE_CHUNK_SIZE,
+    )
+
+    row_spacing, column_spacing = (
+        float(x) for x in first.get("PixelSpacing") or (1.0, 1.0)
+    )
+    slopes, intercepts = np.array([rescale_params(x.header) for x in slices]).T
+    if rescale:
+        slopes, intercepts = np.ones_like(slopes), np.zeros_like(intercepts)
+    return Volume(
+        data=out,
+        spacing=(
+            slice_spacing(
+                [slice_position(x.header) for x in slices],
+                float(first.get("SliceThickness") or 1.0),
+            ),
+            row_spacing,
+            column_spacing,
+        ),
+        slices=[x.pk for x in slices],
+        slopes=slopes,
+        intercepts=intercepts,
+    )
+
+
+def volume_cache_dir(project: Project) -> Path:
+    return Path(settings.DICOM_VOLUME_CACHE_ROOT) / str(project.pk)
+
+
+def load_volume(project: Project) -> Volume | None:
+    """Memory-map the cached volume, or None if it is missing or stale."""
+    directory = volume_cache_dir(project)
+    try:
+        with open(directory / "volume.json") as f:
+            meta = json.load(f)
+        data = np.load(directory / "volume.npy", mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if set(meta["slices"]) != set(project.files.values_list("pk", flat=True)):
+        return None
+    return Volume(
+        data=data,
+        spacing=tuple(meta["spacing"]),
+        slices=meta["slices"],
+        slopes=np.array(meta["slopes"]),
+        intercepts=np.array(meta["intercepts"]),
+    )
+
+
+def write_volume(project: Project) -> Volume:
+    """
+    Decode the project once into a raw `.npy` plus a json sidecar.
+
+    Pixels are kept in their stored dtype, the modality LUT goes to the
+    sidecar and is applied by `Volume.modality` when needed.
+    """
+    slices = project_slices(project)
+    if not slices:
+        raise ValueError("no slices to build a volume from")
+    first = slices[0].header
+    directory = volume_cache_dir(project)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    # web and worker processes may both be writing, each needs its own file
+    tmp = temporary_path(directory / "volume.npy")
+    try:
+        out = np.lib.format.open_memmap(
+            tmp,
+            mode="w+",
+            dtype=volume_dtype(slices, rescale=False),
+            shape=(len(slices), int(first.Rows), int(first.Columns)),
+        )
+        volume = build_volume(slices, rescale=False, out=out)
+        out.flush()
+        del out
+        os.replace(tmp, directory / "volume.npy")
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    meta = {
+        "spacing": volume.spacing,
+        "slices": volume.slices,
+        "slopes": volume.slopes.tolist(),
+        "intercepts": volume.intercepts.tolist(),
+    }
+    write_atomic(directory / "volume.json", json.dumps(meta).encode())
+    return load_volume(project) or volume
+
+
+def invalidate_volume(project: Project):
+    shutil.rmtree(volume_cache_dir(project), ignore_errors=True)
+
+
+def get_volume(project: Project, rescale: bool = True) -> Volume:
+    volume = load_volume(project) or write_volume(project)
+    if rescale:
+        return volume.modality()
+    return volume
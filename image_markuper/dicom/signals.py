@@ -1,35 +1,53 @@
-from dicom.models import Dicom, Layer, Project
-from django.db.models.signals import post_save
+from dicom.models import Dicom, Layer, MeshLevel, MeshVariant, Project
+from dicom.services import (
+    drop_project_caches,
+    invalidate_shapes,
+    invalidate_volume,
+    release_dicom_file,
+    schedule_previews,
+    update_project_thumbnail,
+)
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from utils.generators import generate_charset
-
-
-@receiver(post_save, sender=Project)
-def create_project(sender, instance: Project, created, **kwargs):
-    if created:
-        slug = generate_charset(5)
-        while Project.objects.filter(slug=slug):
-            slug = generate_charset(5)
-        instance.slug = slug
-        instance.save()
 
 
 @receiver(post_save, sender=Dicom)
 def create_dicom(sender, instance: Dicom, created, **kwargs):
     if created:
-        slug = generate_charset(5)
-        while Dicom.objects.filter(slug=slug):
-            slug = generate_charset(5)
-        instance.slug = slug
-        instance.save()
         Layer.objects.create(parent=None, dicom=instance, name="root")
+        if instance.project_id:
+            drop_project_caches(instance.project_id)
+        schedule_previews([instance])
 
 
-@receiver(post_save, sender=Layer)
-def create_layer(sender, instance: Layer, created, **kwargs):
-    if created:
-        slug = generate_charset(8)
-        while Layer.objects.filter(slug=slug):
-            slug = generate_charset(8)
-        instance.slug = slug
-        instance.save()
+@receiver(post_delete, sender=Dicom)
+def delete_dicom(sender, instance: Dicom, **kwargs):
+    invalidate_shapes(instance.pk)
+    if instance.project_id:
+        drop_project_caches(instance.project_id)
+        # the thumbnail was set null with the row it pointed at
+        if Project.objects.filter(pk=instance.project_id, thumbnail=None).exists():
+            update_project_thumbnail(instance.project_id)
+    # content addressed files go with the last row referencing them
+    release_dicom_file(instance)
+
+
+@receiver(post_delete, sender=Project)
+def delete_project(sender, instance: Project, **kwargs):
+    invalidate_volume(instance)
+    for file in (instance.stl, instance.ply, instance.glb):
+        if file:
+            file.delete(save=False)
+
+
+@receiver(post_delete, sender=MeshLevel)
+def delete_mesh_level(sender, instance: MeshLevel, **kwargs):
+    # LOD0 shares its file with the project, which deletes it
+    if instance.level and instance.file:
+        instance.file.delete(save=False)
+
+
+@receiver(post_delete, sender=MeshVariant)
+def delete_mesh_variant(sender, instance: MeshVariant, **kwargs):
+    if instance.file:
+        instance.file.delete(save=False)
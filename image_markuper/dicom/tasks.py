@@ -1,9 +1,33 @@
 from celery import shared_task
 from dicom import services
-from dicom.models import Project
+from dicom.models import Dicom, MeshVariant, UploadJob
 
 
 @shared_task()
 def process_project(pk: int):
-    services.generate_3d_model(Project.objects.get(pk=pk))
+    services.rebuild_project(pk)
     return pk
+
+
+@shared_task()
+def process_volume(pk: int):
+    services.build_volume_cache(pk)
+    return pk
+
+
+@shared_task()
+def process_mesh_variant(pk: int):
+    services.generate_mesh_variant(MeshVariant.objects.get(pk=pk))
+    return pk
+
+
+@shared_task()
+def process_upload_job(pk: int):
+    services.run_upload_job(UploadJob.objects.get(pk=pk))
+    return pk
+
+
+@shared_task()
+def process_previews(pks: list[int]):
+    services.generate_previews(Dicom.objects.filter(pk__in=pks).order_by("pk"))
+    return len(pks)
@@ -0,0 +1,67 @@
+import hashlib
+import io
+
+import numpy as np
+from dicom.models import Dicom
+from dicom.services import store_dicom
+from django.core.files.base import ContentFile
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian, generate_uid
+
+STUDY_INSTANCE_UID = generate_uid()
+SERIES_INSTANCE_UID = generate_uid()
+
+
+def dicom_bytes(
+    position: float = 0.0,
+    value: int = 1000,
+    side: int = 16,
+    sop_instance_uid: str | None = None,
+) -> bytes:
+    """A Part 10 CT slice of `side` squared pixels, `value` HU inside a disc."""
+    sop_instance_uid = sop_instance_uid or generate_uid()
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = CTImageStorage
+    file_meta.MediaStorageSOPInstanceUID = sop_instance_uid
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    dataset = FileDataset(None, {}, file_meta=file_meta, preamble=b"\0" * 128)
+    dataset.is_little_endian = True
+    dataset.is_implicit_VR = False
+    dataset.SOPClassUID = CTImageStorage
+    dataset.SOPInstanceUID = sop_instance_uid
+    dataset.StudyInstanceUID = STUDY_INSTANCE_UID
+    dataset.SeriesInstanceUID = SERIES_INSTANCE_UID
+    dataset.Modality = "CT"
+    dataset.InstanceNumber = int(position)
+    dataset.ImagePositionPatient = [0.0, 0.0, position]
+    dataset.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+    dataset.SliceThickness = 1.0
+    dataset.PixelSpacing = [0.5, 0.5]
+    dataset.Rows = dataset.Columns = side
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = "MONOCHROME2"
+    dataset.BitsAllocated = dataset.BitsStored = 16
+    dataset.HighBit = 15
+    dataset.PixelRepresentation = 1
+    dataset.RescaleSlope = 1
+    dataset.RescaleIntercept = -1024
+
+    y, x = np.mgrid[:side, :side] - (side - 1) / 2
+    inside = x**2 + y**2 < (side / 3) ** 2
+    pixels = np.where(inside, value + 1024, 0).astype("<i2")
+    dataset.PixelData = pixels.tobytes()
+
+    buffer = io.BytesIO()
+    dataset.save_as(buffer, write_like_original=False)
+    return buffer.getvalue()
+
+
+def stored_dicoms(content: bytes, count: int = 1, project=None) -> list[Dicom]:
+    """`count` rows sharing one stored payload, as ingest would leave them."""
+    sha256 = hashlib.sha256(content).hexdigest()
+    name = store_dicom(ContentFile(content), sha256)
+    return [
+        Dicom.objects.create(file=name, sha256=sha256, project=project)
+        for _ in range(count)
+    ]
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from dicom.services.decode import decode_slices
+from dicom.tests.factories import dicom_bytes
+
+
+@pytest.fixture
+def paths(tmp_path) -> list[str]:
+    paths = []
+    for i in range(7):
+        path = tmp_path / f"{i}.dcm"
+        path.write_bytes(dicom_bytes(position=i, value=100 * i))
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("rescale, dtype", [(True, np.float32), (False, np.int16)])
+@pytest.mark.parametrize("memory_mapped", [False, True])
+def test_parallel_decoding_matches_serial(
+    paths, tmp_path, rescale, dtype, memory_mapped
+):
+    serial = np.empty((len(paths), 16, 16), dtype=dtype)
+    decode_slices(paths, serial, rescale)
+
+    if memory_mapped:
+        parallel = np.lib.format.open_memmap(
+            tmp_path / "volume.npy", mode="w+", dtype=dtype, shape=serial.shape
+        )
+    else:
+        parallel = np.zeros_like(serial)
+    decode_slices(paths, parallel, rescale, workers=2, chunk_size=2)
+
+    assert np.array_equal(parallel, serial)
+    assert serial[1].max() == (100 if rescale else 1124)
@@ -0,0 +1,99 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+from dicom.models import Project
+from dicom.services.mesh import save_mesh
+from django.urls import reverse
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+from utils.files import parse_range
+
+pytestmark = pytest.mark.django_db
+
+TETRAHEDRON = (
+    np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32),
+    np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]]),
+    np.zeros((4, 3), dtype=np.float32),
+)
+
+
+@pytest.fixture
+def project(user) -> Project:
+    project = Project.objects.create(name="mesh", user=user)
+    save_mesh(project, *TETRAHEDRON)
+    return project
+
+
+@pytest.fixture
+def client(user) -> APIClient:
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def stl_url(project: Project) -> str:
+    return reverse("get_project_stl", kwargs={"slug": project.slug})
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-9", (0, 9)),
+        ("bytes=10-", (10, 99)),
+        ("bytes=-10", (90, 99)),
+        ("bytes=90-500", (90, 99)),
+        ("bytes=0-1,5-6", None),
+        ("items=0-1", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=5-4"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+def test_stl_strong_etag(project, client):
+    content = project.stl.read()
+    response = client.get(stl_url(project))
+
+    assert response.status_code == 200
+    assert response["ETag"] == f'"{hashlib.sha256(content).hexdigest()}"'
+    assert b"".join(response.streaming_content) == content
+    response = client.get(stl_url(project), HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == 304
+
+
+def test_stl_range(project, client):
+    content = project.stl.read()
+    size = len(content)
+    etag = f'"{project.stl_sha256}"'
+    modified = http_date(int(os.stat(project.stl.path).st_mtime))
+
+    response = client.get(stl_url(project), HTTP_RANGE="bytes=80-")
+    assert response.status_code == 206
+    assert response["Content-Range"] == f"bytes 80-{size - 1}/{size}"
+    assert b"".join(response.streaming_content) == content[80:]
+
+    for if_range in (etag, modified):
+        response = client.get(
+            stl_url(project), HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=if_range
+        )
+        assert response.status_code == 206
+        assert b"".join(response.streaming_content) == content[:10]
+
+    for if_range in ('"other"', f"W/{etag}", http_date(0)):
+        response = client.get(
+            stl_url(project), HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=if_range
+        )
+        assert response.status_code == 200
+        assert int(response["Content-Length"]) == size
+
+    response = client.get(stl_url(project), HTTP_RANGE=f"bytes={size}-")
+    assert response.status_code == 416
+    assert response["Content-Range"] == f"bytes */{size}"
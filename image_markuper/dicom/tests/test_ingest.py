@@ -0,0 +1,112 @@
+import io
+import zipfile
+
+import numpy as np
+import pytest
+from dicom.models import Dicom, Project
+from dicom.services import header_fields, process_files, project_slices
+from dicom.services import rebuild as rebuild_module
+from dicom.services.headers import read_header
+from dicom.tests.factories import dicom_bytes, stored_dicoms
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from pydicom.uid import ExplicitVRLittleEndian
+
+
+class Rollback(Exception):
+    pass
+
+
+@pytest.fixture
+def project(user, monkeypatch) -> Project:
+    # rebuilds are debounced through Redis, ingest only needs to ask for one
+    monkeypatch.setattr(rebuild_module, "schedule_project_rebuild", lambda pk: None)
+    return Project.objects.create(name="ingest", user=user)
+
+
+def upload(name: str, content: bytes) -> SimpleUploadedFile:
+    return SimpleUploadedFile(name, content)
+
+
+def archive(members: dict[str, bytes]) -> SimpleUploadedFile:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    return upload("study.zip", buffer.getvalue())
+
+
+def test_header_fields():
+    fields = header_fields(read_header(io.BytesIO(dicom_bytes(position=2.5))))
+
+    assert fields["instance_number"] == 2
+    assert fields["image_position"] == [0.0, 0.0, 2.5]
+    assert fields["slice_position"] == 2.5
+    assert fields["pixel_spacing"] == [0.5, 0.5]
+    assert (fields["rows"], fields["columns"]) == (16, 16)
+    assert (fields["bits_allocated"], fields["pixel_representation"]) == (16, 1)
+    assert (fields["rescale_slope"], fields["rescale_intercept"]) == (1.0, -1024.0)
+    assert fields["transfer_syntax"] == ExplicitVRLittleEndian
+    assert fields["slice_location"] is None
+
+
+@pytest.mark.django_db
+def test_process_files_indexes_and_dedupes(project):
+    first, second, third = (dicom_bytes(position=x) for x in (2.5, 0, 1))
+    files = [
+        upload("first.dcm", first),
+        archive({"dir/second.dcm": second, "readme.txt": b"notes", "copy.dcm": first}),
+        upload("notes.txt", b"not a dicom"),
+        archive({"third.dcm": third}),
+    ]
+
+    assert process_files(files, project) == (3, 2, 1)
+    # the same payload, and another one of an instance the project has
+    again = dicom_bytes(
+        position=7, sop_instance_uid=read_header(io.BytesIO(third)).SOPInstanceUID
+    )
+    assert process_files(
+        [upload("again.dcm", first), upload("x.dcm", again)], project
+    ) == (0, 0, 2)
+
+    slices = list(project.slices)
+    assert [x.slice_position for x in slices] == [0, 1, 2.5]
+    assert all(x.file.name.endswith(f"{x.sha256}.dcm") for x in slices)
+    assert all(x.layers.filter(name="root").exists() for x in slices)
+
+
+@pytest.mark.django_db
+def test_project_slices_from_the_index(project, django_assert_num_queries):
+    process_files(
+        [upload(f"{x}.dcm", dicom_bytes(position=x)) for x in (3, 1, 2)], project
+    )
+
+    with django_assert_num_queries(1):
+        slices = project_slices(project)
+
+    assert [x.header.ImagePositionPatient[2] for x in slices] == [1, 2, 3]
+    assert np.allclose([x.header.PixelSpacing for x in slices], 0.5)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_delete_dicom_keeps_shared_file():
+    first, second = stored_dicoms(b"payload", count=2)
+    storage = first.file.storage
+
+    first.delete()
+    assert storage.exists(second.file.name)
+
+    second.delete()
+    assert not storage.exists(second.file.name)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_delete_dicom_rolled_back_keeps_file():
+    (dicom,) = stored_dicoms(b"payload")
+
+    with pytest.raises(Rollback), transaction.atomic():
+        dicom.delete()
+        raise Rollback
+
+    assert Dicom.objects.filter(sha256=dicom.sha256).exists()
+    assert dicom.file.storage.exists(dicom.file.name)
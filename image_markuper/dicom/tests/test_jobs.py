@@ -0,0 +1,40 @@
+import pytest
+from dicom.models import UploadJob
+from dicom.services import create_upload_job
+from dicom.services import jobs as jobs_module
+from dicom.services import run_upload_job
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def job(user) -> UploadJob:
+    return create_upload_job([SimpleUploadedFile("a.dcm", b"payload")], user)
+
+
+def test_failed_upload_job_keeps_details_out_of_the_api(job, monkeypatch, caplog):
+    def process_files(*args):
+        raise OSError("/srv/media/uploads/jobs/a.dcm: disk full")
+
+    monkeypatch.setattr(jobs_module, "process_files", process_files)
+
+    with pytest.raises(OSError):
+        run_upload_job(job)
+
+    job.refresh_from_db()
+    assert job.status == UploadJob.Status.failed
+    assert job.error == jobs_module.UPLOAD_JOB_ERROR
+    assert "disk full" in caplog.text
+
+
+def test_upload_job_api_keeps_pending_alias(job, user):
+    client = APIClient()
+    client.force_authenticate(user)
+
+    response = client.get(reverse("get_upload_job", kwargs={"slug": job.slug}))
+
+    assert response.status_code == 200
+    assert response.data["uploads_pending"] == response.data["pending"] == 1
@@ -0,0 +1,70 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+from dicom.services.mesh import extract_surface, to_glb, to_ply
+from dicom.services.volume import Volume
+
+CENTER = 15.5
+
+
+def sphere(radius: float = 10, side: int = 32) -> Volume:
+    z, y, x = np.mgrid[:side, :side, :side]
+    inside = (z - CENTER) ** 2 + (y - CENTER) ** 2 + (x - CENTER) ** 2 < radius**2
+    return Volume(
+        data=np.where(inside, 1000, 0).astype(np.float32),
+        spacing=(1.0, 1.0, 1.0),
+        slices=list(range(side)),
+        slopes=np.ones(side),
+        intercepts=np.zeros(side),
+    )
+
+
+def read_ply(content: bytes):
+    header, body = content.split(b"end_header\n", 1)
+    count = int(header.split(b"element vertex ")[1].split()[0])
+    vertex = np.frombuffer(
+        body, dtype=[("xyz", "<f4", 3), ("normal", "<f4", 3)], count=count
+    )
+    face = np.frombuffer(
+        body, dtype=[("count", "u1"), ("indices", "<i4", 3)], offset=vertex.nbytes
+    )
+    return vertex["xyz"], face["indices"], vertex["normal"]
+
+
+def read_glb(content: bytes):
+    length = struct.unpack_from("<I", content, 12)[0]
+    gltf = json.loads(content[20 : 20 + length])  # noqa
+    binary = content[20 + length + 8 :]  # noqa
+    arrays = []
+    for accessor in gltf["accessors"]:
+        view = gltf["bufferViews"][accessor["bufferView"]]
+        dtype = "<f4" if accessor["componentType"] == 5126 else "<u4"
+        array = np.frombuffer(
+            binary,
+            dtype=dtype,
+            count=view["byteLength"] // 4,
+            offset=view["byteOffset"],
+        )
+        arrays.append(array.reshape(-1, 3))
+    verts, normals, faces = arrays
+    return verts, faces, normals
+
+
+@pytest.mark.parametrize("memory_limit", [1024**3, 32 * 32 * 4 * 3 * 8])
+@pytest.mark.parametrize("write, read", [(to_ply, read_ply), (to_glb, read_glb)])
+def test_indexed_mesh_faces_wind_outward(settings, memory_limit, write, read):
+    # a small limit walks the volume in slabs of 8 planes
+    settings.DICOM_MESH_MEMORY_LIMIT = memory_limit
+    verts, faces, normals = read(write(*extract_surface(sphere(), 500)))
+
+    triangles = verts[faces]
+    face_normals = np.cross(
+        triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0]
+    )
+    outward = triangles.mean(axis=1) - CENTER
+    assert (np.einsum("ij,ij->i", face_normals, outward) > 0).all()
+    assert (np.einsum("ij,ij->i", normals, verts - CENTER) > 0).all()
+    corner_normals = normals[faces].sum(axis=1)
+    assert (np.einsum("ij,ij->i", face_normals, corner_normals) > 0).all()
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from dicom.models import Project
+from dicom.services import build_octree
+from dicom.services import octree as octree_module
+from dicom.services import query_octree
+from dicom.services.octree import octree_dir
+from dicom.services.volume import Volume
+
+THRESHOLD = 200
+
+
+@pytest.fixture
+def data() -> np.ndarray:
+    values = np.random.default_rng(7).integers(0, 256, (20, 24, 28), dtype=np.int16)
+    # mostly empty, with one dense region
+    values[values < 240] = 0
+    values[5:12, 6:14, 3:20] = 250
+    return values
+
+
+@pytest.fixture
+def project(data, settings, tmp_path, monkeypatch) -> Project:
+    settings.DICOM_VOLUME_CACHE_ROOT = str(tmp_path / "volumes")
+    volume = Volume(
+        data=data,
+        spacing=(1.0, 1.0, 1.0),
+        slices=list(range(len(data))),
+        slopes=np.ones(len(data)),
+        intercepts=np.zeros(len(data)),
+    )
+    monkeypatch.setattr(octree_module, "get_volume", lambda *args, **kwargs: volume)
+    return Project(pk=1)
+
+
+def levels(project: Project) -> list[np.ndarray]:
+    meta = octree_module.read_octree(project)
+    directory = octree_dir(project) / meta["version"]
+    return [np.load(directory / f"level_{x}.npy") for x in range(meta["depth"] + 1)]
+
+
+def test_octree_levels(project, data):
+    meta = build_octree(project, THRESHOLD)
+
+    assert meta["depth"] == 5
+    voxels = np.count_nonzero(data > THRESHOLD)
+    for level in levels(project):
+        assert (np.diff(level["code"].astype(np.int64)) > 0).all()
+        assert level["count"].sum() == voxels
+        assert level["value"].max() == data.max()
+    (root,) = levels(project)[0]
+    z, y, x = np.nonzero(data > THRESHOLD)
+    assert np.allclose(root["xyz"], [x.mean(), y.mean(), z.mean()], atol=1e-3)
+
+
+def test_octree_built_in_pieces_matches_whole(project, settings):
+    build_octree(project, THRESHOLD)
+    whole = levels(project)
+
+    # 64 records per piece: 4 voxel cubes and chunks cut through sibling groups
+    settings.DICOM_OCTREE_MEMORY_LIMIT = 64 * octree_module.BUILD_RECORD_BYTES
+    build_octree(project, THRESHOLD)
+
+    for expected, level in zip(whole, levels(project), strict=True):
+        assert np.array_equal(level["code"], expected["code"])
+        assert np.array_equal(level["count"], expected["count"])
+        assert np.allclose(level["xyz"], expected["xyz"])
+    assert len(list(octree_dir(project).iterdir())) == 2
+
+
+def test_query_octree_matches_brute_force(project, data, settings):
+    settings.DICOM_OCTREE_MEMORY_LIMIT = 64 * octree_module.BUILD_RECORD_BYTES
+    build_octree(project, THRESHOLD)
+    rng = np.random.default_rng(11)
+    for _ in range(50):
+        lo = rng.integers(0, [28, 24, 20])
+        hi = lo + rng.integers(1, 12, 3)
+        points, truncated = query_octree(project, tuple(lo), tuple(hi), 5, 10**6)
+
+        box = data[lo[2] : hi[2], lo[1] : hi[1], lo[0] : hi[0]]  # noqa
+        z, y, x = np.nonzero(box > THRESHOLD)
+        expected = np.stack([x + lo[0], y + lo[1], z + lo[2]], axis=1)
+        assert not truncated
+        assert sorted(map(tuple, points["xyz"].astype(int))) == sorted(
+            map(tuple, expected)
+        )
+
+
+def test_query_octree_limit(project):
+    build_octree(project, THRESHOLD)
+
+    points, truncated = query_octree(project, (0, 0, 0), (28, 24, 20), 5, 10)
+    assert len(points) == 10
+    assert truncated
+    assert query_octree(Project(pk=2), (0, 0, 0), (1, 1, 1), 5, 10) is None
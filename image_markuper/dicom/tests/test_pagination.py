@@ -0,0 +1,119 @@
+from datetime import timedelta
+
+import pytest
+from dicom.models import Dicom, Project
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from users.tests.factories import UserFactory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def projects(user) -> list[Project]:
+    """Nine projects of `user`, a day apart, newest first."""
+    now = timezone.now()
+    projects = []
+    for i in range(9):
+        project = Project.objects.create(name=f"p{i}", user=user, pathology_type=i % 3)
+        Project.objects.filter(pk=project.pk).update(created=now - timedelta(days=i))
+        projects.append(project)
+    Project.objects.create(name="other", user=UserFactory())
+    return projects
+
+
+def client_of(user) -> APIClient:
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def pages(client: APIClient, url: str, params: dict) -> list[list[dict]]:
+    pages = []
+    response = client.get(url, params)
+    while True:
+        assert response.status_code == 200
+        pages.append(response.data["results"])
+        if not response.data["next"]:
+            return pages
+        response = client.get(response.data["next"])
+
+
+def test_project_pages(user, projects):
+    client = client_of(user)
+    url = reverse("list_create_project")
+
+    found = pages(client, url, {"page_size": 4})
+
+    assert [len(x) for x in found] == [4, 4, 1]
+    assert [x["slug"] for page in found for x in page] == [x.slug for x in projects]
+
+
+def test_project_page_queries_do_not_grow(user, projects):
+    client = client_of(user)
+    url = reverse("list_create_project")
+    third = client.get(client.get(url, {"page_size": 3}).data["next"]).data["next"]
+
+    with CaptureQueriesContext(connection) as top:
+        client.get(url, {"page_size": 3})
+    with CaptureQueriesContext(connection) as deep:
+        client.get(third)
+
+    assert len(deep) == len(top)
+
+
+def test_project_filters(user, projects):
+    client = client_of(user)
+    url = reverse("list_create_project")
+    after = (timezone.now() - timedelta(days=4, hours=12)).isoformat()
+
+    def slugs(params):
+        return [x["slug"] for page in pages(client, url, params) for x in page]
+
+    assert slugs({"pathology_type": 1}) == [projects[x].slug for x in (1, 4, 7)]
+    assert slugs({"after": after}) == [x.slug for x in projects[:5]]
+    assert slugs({"before": after, "pathology_type": 2}) == [
+        projects[x].slug for x in (5, 8)
+    ]
+    assert (
+        client.get(url, {"after": after, "before": "2000-01-01T00:00"}).status_code
+        == 400
+    )
+
+
+def test_staff_project_filter_by_user(user, projects):
+    client = client_of(UserFactory(is_staff=True))
+    url = reverse("list_create_project")
+
+    everyone = client.get(url, {"page_size": 50}).data["results"]
+    owned = client.get(url, {"page_size": 50, "user": user.username}).data["results"]
+
+    assert len(everyone) == 10
+    assert [x["slug"] for x in owned] == [x.slug for x in projects]
+    assert owned[0]["user_username"] == user.username
+
+
+def test_dicom_pages_and_filters(user):
+    now = timezone.now()
+    dicoms = []
+    for i in range(5):
+        dicom = Dicom.objects.create(
+            file=f"dicom/{i}.dcm", series_instance_uid="1.2" if i % 2 else "1.3"
+        )
+        Dicom.objects.filter(pk=dicom.pk).update(uploaded=now - timedelta(hours=i))
+        dicoms.append(dicom)
+    client = client_of(user)
+    url = reverse("dicom_list_create")
+
+    found = pages(client, url, {"page_size": 2})
+    series = pages(client, url, {"series": "1.2"})
+
+    assert [x["url"] for page in found for x in page] == [
+        f"http://testserver{x.get_absolute_url()}" for x in dicoms
+    ]
+    assert [x["url"] for x in series[0]] == [
+        f"http://testserver{x.get_absolute_url()}" for x in dicoms[1:4:2]
+    ]
@@ -0,0 +1,44 @@
+import gzip
+from pathlib import Path
+
+import numpy as np
+import pytest
+from dicom.services.pixels import cached_slice, pixel_dir
+from dicom.tests.factories import dicom_bytes, stored_dicoms
+
+
+@pytest.fixture(autouse=True)
+def pixel_cache(settings, tmp_path) -> Path:
+    settings.DICOM_PIXEL_CACHE_ROOT = str(tmp_path / "pixels")
+    return tmp_path / "pixels"
+
+
+def cached(root: Path) -> list[str]:
+    return sorted(x.suffix for x in root.rglob("*") if x.is_file())
+
+
+@pytest.mark.django_db
+def test_cached_slice_rebuilds_missing_raw(pixel_cache):
+    (dicom,) = stored_dicoms(dicom_bytes(value=500))
+    cached_slice(dicom, "zstd")
+    assert cached(pixel_cache) == [".json", ".raw", ".zstd"]
+
+    (pixel_dir(dicom.content_key) / f"{dicom.content_key}.raw").unlink()
+    meta, frame = cached_slice(dicom, "gzip")
+
+    pixels = np.frombuffer(gzip.decompress(frame.read_bytes()), "<i2")
+    assert meta == {"shape": [16, 16], "rescale": [1.0, -1024.0]}
+    assert pixels.max() == 500 + 1024
+    assert cached(pixel_cache) == [".gzip", ".json", ".raw", ".zstd"]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_delete_dicom_drops_pixels(pixel_cache):
+    first, second = stored_dicoms(dicom_bytes(), count=2)
+    cached_slice(first, "raw")
+
+    first.delete()
+    assert cached(pixel_cache) == [".json", ".raw"]
+
+    second.delete()
+    assert cached(pixel_cache) == []
@@ -0,0 +1,70 @@
+from pathlib import Path
+
+import pytest
+from dicom.services import render_slice
+from dicom.services.render import WINDOW_PRESETS
+from dicom.tests.factories import dicom_bytes, stored_dicoms
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+
+@pytest.fixture(autouse=True)
+def render_cache(settings, tmp_path) -> Path:
+    settings.DICOM_RENDER_CACHE_ROOT = str(tmp_path / "renders")
+    settings.DICOM_PREVIEW_SIZES = [64]
+    return tmp_path / "renders"
+
+
+def cached(root: Path) -> list[str]:
+    return sorted(x.name.split("_", 1)[1] for x in root.rglob("*") if x.is_file())
+
+
+@pytest.mark.django_db
+def test_render_caches_presets_and_previews_only(render_cache):
+    (dicom,) = stored_dicoms(dicom_bytes())
+
+    render_slice(dicom, None, 64, "webp")
+    render_slice(dicom, WINDOW_PRESETS["lung"], None, "png")
+    assert cached(render_cache) == ["-600_1500_full.png", "auto_auto_64.webp"]
+
+    content = render_slice(dicom, (10, 500), 100, "png")
+    render_slice(dicom, WINDOW_PRESETS["bone"], 100, "png")
+    render_slice(dicom, (11, 500), None, "png")
+    assert content.startswith(b"\x89PNG")
+    assert len(cached(render_cache)) == 2
+    # cached renders are served from the cache
+    assert render_slice(dicom, None, 64, "webp") == render_slice(
+        dicom, None, 64, "webp"
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_delete_dicom_drops_renders(render_cache):
+    first, second = stored_dicoms(dicom_bytes(), count=2)
+    render_slice(first, None, 64, "png")
+
+    first.delete()
+    assert len(cached(render_cache)) == 1
+
+    second.delete()
+    assert cached(render_cache) == []
+
+
+@pytest.mark.django_db
+def test_render_api(user, render_cache):
+    (dicom,) = stored_dicoms(dicom_bytes())
+    client = APIClient()
+    client.force_authenticate(user)
+    url = reverse("render_dicom", kwargs={"slug": dicom.slug})
+
+    response = client.get(url, {"center": 40, "width": 400, "size": 32})
+    assert response.status_code == 200
+    assert response["Content-Type"] == "image/png"
+    assert cached(render_cache) == []
+
+    response = client.get(
+        url,
+        {"center": 40, "width": 400, "size": 32},
+        HTTP_IF_NONE_MATCH=response["ETag"],
+    )
+    assert response.status_code == 304
@@ -0,0 +1,117 @@
+import pytest
+from dicom.models import Dicom
+from dicom.services import (
+    cached_shapes,
+    invalidate_shapes,
+    replace_shapes,
+    shape_cache_stats,
+)
+from django.core.cache import cache
+from django.db import transaction
+from django.urls import reverse
+from rest_framework.test import APIClient
+from users.tests.factories import UserFactory
+
+# invalidation runs in on_commit, which only fires outside the test transaction
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+class Rollback(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def dicom() -> Dicom:
+    return Dicom.objects.create(file="dicom/test.dcm")
+
+
+class Build:
+    """Counts its calls, the layers of its payload tell which call built it."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self) -> dict:
+        self.calls += 1
+        return {"shapes": [], "layers": [self.calls]}
+
+
+def test_cached_shapes_until_invalidated(dicom: Dicom):
+    build = Build()
+
+    assert cached_shapes(dicom.pk, build) == {"shapes": [], "layers": [1]}
+    assert cached_shapes(dicom.pk, build) == {"shapes": [], "layers": [1]}
+    invalidate_shapes(dicom.pk)
+    assert cached_shapes(dicom.pk, build) == {"shapes": [], "layers": [2]}
+
+    assert build.calls == 2
+    assert shape_cache_stats() == {
+        "hits": 1,
+        "misses": 2,
+        "invalidations": 1,
+        "hit_rate": 1 / 3,
+    }
+
+
+def test_invalidation_waits_for_commit(dicom: Dicom):
+    other = Dicom.objects.create(file="dicom/other.dcm")
+    build = Build()
+    cached_shapes(dicom.pk, build)
+    cached_shapes(other.pk, build)
+
+    with transaction.atomic():
+        invalidate_shapes(dicom.pk)
+        # a read inside the writing transaction still gets the old entry
+        assert cached_shapes(dicom.pk, build)["layers"] == [1]
+
+    assert cached_shapes(dicom.pk, build)["layers"] == [3]
+    assert cached_shapes(other.pk, build)["layers"] == [2]
+    assert shape_cache_stats()["invalidations"] == 1
+
+
+def test_rolled_back_write_keeps_entry(dicom: Dicom):
+    build = Build()
+    cached_shapes(dicom.pk, build)
+
+    with pytest.raises(Rollback), transaction.atomic():
+        invalidate_shapes(dicom.pk)
+        raise Rollback
+
+    assert cached_shapes(dicom.pk, build)["layers"] == [1]
+    assert shape_cache_stats()["invalidations"] == 0
+
+
+def test_replace_shapes_refreshes_api(user, dicom: Dicom):
+    client = APIClient()
+    client.force_authenticate(user)
+    url = reverse("update_dicom_layer", kwargs={"dicom_slug": dicom.slug})
+    shape = {"type": "ruler", "layer": "", "coordinates": [{"x": 1, "y": 2}]}
+
+    assert client.get(url).data["shapes"] == []
+    replace_shapes(dicom, [shape])
+    shapes = client.get(url).data["shapes"]
+    assert client.get(url).data["shapes"] == shapes
+
+    assert [x["type"] for x in shapes] == ["ruler"]
+    assert shape_cache_stats()["hits"] == 1
+
+
+def test_stats_api_is_for_staff(user):
+    url = reverse("get_shape_cache_stats")
+    client = APIClient()
+    client.force_authenticate(user)
+    assert client.get(url).status_code == 403
+
+    client.force_authenticate(UserFactory(is_staff=True))
+    response = client.get(url)
+
+    assert response.status_code == 200
+    assert response.data["hits"] == 0
+    assert response.data["hit_rate"] is None
@@ -0,0 +1,88 @@
+from io import StringIO
+
+import pytest
+from dicom.models import BaseShape, Circle, Coordinate, Dicom, Roi
+from dicom.services import delete_shapes, replace_shapes
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+
+pytestmark = pytest.mark.django_db
+
+SHAPE_TYPES = ["circle", "roi", "free_hand", "ruler"]
+
+
+def make_shapes(count: int) -> list[dict]:
+    shapes = []
+    for i in range(count):
+        shape = {
+            "type": SHAPE_TYPES[i % len(SHAPE_TYPES)],
+            "layer": "",
+            "coordinates": [{"x": i, "y": 1.5}, {"x": i + 1, "y": 2.5}],
+        }
+        if shape["type"] == "circle":
+            shape["radius"] = float(i)
+        shapes.append(shape)
+    return shapes
+
+
+@pytest.fixture
+def dicom() -> Dicom:
+    dicom = Dicom.objects.create(file="dicom/test.dcm")
+    # ContentType caches per process, keep its first lookups out of the counts
+    for model in BaseShape.__subclasses__():
+        ContentType.objects.get_for_model(model, for_concrete_model=False)
+    return dicom
+
+
+def test_replace_shapes(dicom: Dicom):
+    shape = Roi.objects.create(layer_fk=dicom.layers.get(), points=b"")
+    Coordinate.objects.create(shape=shape, x=1, y=2)
+
+    replace_shapes(dicom, make_shapes(5))
+
+    assert not Coordinate.objects.exists()
+    shapes = dicom.get_shapes()
+    assert [x.TYPE for x in shapes] == [*SHAPE_TYPES, "circle"]
+    assert shapes[1].coordinates == [{"x": 1, "y": 1.5}, {"x": 2, "y": 2.5}]
+    assert [x.radius for x in shapes if isinstance(x, Circle)] == [0, 4]
+
+
+@pytest.mark.parametrize("count", [10, 300])
+def test_replace_shapes_query_count(dicom: Dicom, count, django_assert_num_queries):
+    replace_shapes(dicom, make_shapes(count))
+
+    # layers, savepoint, 6 deletes, parents, 4 subclass tables, release
+    with django_assert_num_queries(14):
+        replace_shapes(dicom, make_shapes(count))
+    assert BaseShape.objects.count() == count
+
+
+def test_delete_shapes(dicom: Dicom):
+    other = Dicom.objects.create(file="dicom/other.dcm")
+    replace_shapes(dicom, make_shapes(8))
+    replace_shapes(other, make_shapes(3))
+
+    delete_shapes(dicom)
+
+    assert dicom.get_shapes() == []
+    assert len(other.get_shapes()) == 3
+    assert Circle.objects.count() == 1
+
+
+def test_pack_coordinates_keeps_newer_points(dicom: Dicom):
+    layer = dicom.layers.get()
+    legacy = Roi.objects.create(layer_fk=layer, points=b"")
+    edited = Roi.objects.create(layer_fk=layer, points=b"")
+    for shape in (legacy, edited):
+        Coordinate.objects.create(shape=shape, x=1, y=2)
+        Coordinate.objects.create(shape=shape, x=3, y=4)
+    edited.coordinates = [{"x": 5, "y": 6}, {"x": 7, "y": 8}, {"x": 9, "y": 10}]
+    edited.save(update_fields=["points"])
+
+    call_command("pack_coordinates", stdout=StringIO())
+
+    assert not Coordinate.objects.exists()
+    legacy.refresh_from_db()
+    edited.refresh_from_db()
+    assert legacy.coordinates == [{"x": 1, "y": 2}, {"x": 3, "y": 4}]
+    assert len(edited.coordinates) == 3
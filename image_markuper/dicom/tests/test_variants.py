@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+import pytest
+from dicom.models import MeshVariant, Project
+from dicom.services import request_mesh_variant
+from django.utils import timezone
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def project(user) -> Project:
+    return Project.objects.create(name="variants", user=user)
+
+
+def queued_variants(celery_tasks) -> list[int]:
+    return [
+        kwargs["pk"]
+        for name, _, kwargs in celery_tasks
+        if name == "dicom.tasks.process_mesh_variant"
+    ]
+
+
+def test_identical_requests_share_one_build(
+    project, celery_tasks, django_capture_on_commit_callbacks
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        variant, ready = request_mesh_variant(project, 300)
+        again, _ = request_mesh_variant(project, 300)
+
+    assert not ready
+    assert again.pk == variant.pk
+    assert queued_variants(celery_tasks) == [variant.pk]
+
+
+@pytest.mark.parametrize("status", ["pending", "failed"])
+def test_lost_or_failed_build_is_queued_again(
+    project, status, settings, celery_tasks, django_capture_on_commit_callbacks
+):
+    variant, _ = request_mesh_variant(project, 300)
+    lost = timezone.now() - timedelta(seconds=settings.DICOM_MESH_VARIANT_TIMEOUT + 1)
+    MeshVariant.objects.filter(pk=variant.pk).update(status=status, updated=lost)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        variant, ready = request_mesh_variant(project, 300)
+        request_mesh_variant(project, 300)
+
+    assert not ready
+    assert variant.status == MeshVariant.Status.pending
+    assert queued_variants(celery_tasks) == [variant.pk]
+    assert MeshVariant.objects.get(pk=variant.pk).updated > lost
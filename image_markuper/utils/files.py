@@ -1,7 +1,170 @@
+import hashlib
 import os
+import re
+import uuid
+from pathlib import Path
 
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
 from utils.generators import generate_charset
 
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# a year, content addressed files never change under their name
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
 
 def media_upload_path(instance, filename):
     return os.path.join(f"uploads/dicom/{generate_charset(7)}/", filename)
+
+
+def temporary_path(path: Path) -> Path:
+    """A sibling of `path` of one writer's own, to be os.replace'd over it."""
+    return path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+
+
+def write_atomic(path: Path, content: bytes):
+    """
+    Write `content` to `path` through a temporary file, so concurrent readers
+    and writers see either the old file or the new one, never a partial one.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = temporary_path(path)
+    try:
+        tmp.write_bytes(content)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+class FileRange:
+    """
+    Read at most `length` bytes of `file` from `start` on.
+
+    `fileno` stays exposed, so servers that sendfile the stream start at the
+    seeked offset and stop at the response's Content-Length.
+    """
+
+    def __init__(self, file, start: int, length: int):
+        file.seek(start)
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def file_version(path: str) -> str:
+    """
+    Weak validator of a file from its name, size and modification time.
+
+    Equal metadata does not prove equal bytes, so it is good for conditional
+    GET but never for resuming a range, which needs a strong ETag.
+    """
+    stat = os.stat(path)
+    key = f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+    return f'W/"{hashlib.sha256(key.encode()).hexdigest()}"'
+
+
+def if_range_matches(if_range: str, etag: str, last_modified: int) -> bool:
+    """
+    Whether an If-Range validator, an ETag or an HTTP date, still matches the
+    file. ETags compare strongly, a weak one never matches.
+    """
+    modified = parse_http_date_safe(if_range)
+    if modified is not None:
+        return modified == last_modified
+    return not etag.startswith("W/") and etag in parse_etags(if_range)
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Inclusive byte range of a single-range `Range` header, None to send the
+    whole file. Raises ValueError if the range is not satisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        # malformed or multipart ranges, the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, stop = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        stop = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > stop:
+        raise ValueError(f"range {header} outside of {size} bytes")
+    return start, stop
+
+
+def serve_file(
+    request,
+    path: str,
+    content_type: str,
+    etag: str | None = None,
+    immutable: bool = False,
+) -> HttpResponse:
+    """
+    Serve a file with validators, conditional GET and single byte ranges.
+
+    `etag` is a strong validator of the content, without one the weak
+    `file_version` is used and only a date in If-Range resumes a range.
+    `immutable` files are cached for a year without revalidation, anything
+    else is revalidated every time.
+    """
+    stat = os.stat(path)
+    etag = quote_etag(etag or file_version(path))
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        byte_range = None
+        header = request.headers.get("Range")
+        if_range = request.headers.get("If-Range")
+        # a stale If-Range asks for the whole new file instead of a piece
+        if header and (
+            if_range is None or if_range_matches(if_range, etag, last_modified)
+        ):
+            try:
+                byte_range = parse_range(header, stat.st_size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{stat.st_size}"
+                return response
+
+        file = open(path, "rb")
+        if byte_range is None:
+            response = FileResponse(file, content_type=content_type)
+        else:
+            start, stop = byte_range
+            response = FileResponse(
+                FileRange(file, start, stop - start + 1),
+                content_type=content_type,
+                status=206,
+            )
+            response["Content-Length"] = stop - start + 1
+            response["Content-Range"] = f"bytes {start}-{stop}/{stat.st_size}"
+        response["Accept-Ranges"] = "bytes"
+        response["Last-Modified"] = http_date(stat.st_mtime)
+
+    response["ETag"] = etag
+    if immutable:
+        patch_cache_control(
+            response, private=True, max_age=IMMUTABLE_MAX_AGE, immutable=True
+        )
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response